@@ -1,23 +1,44 @@
 # bot_musica.py
+import time
+_PROCESS_STARTED = time.perf_counter()  # Referência para o --benchmark-startup
+
 import discord
-from discord.ext import commands
-import yt_dlp
+from discord import app_commands
+from discord.ext import commands, tasks
 import asyncio
 import collections
+import concurrent.futures
+import contextlib
 import functools
-
-# --- Exceção Customizada para Restrição de Idade ---
-class AgeRestrictionError(yt_dlp.utils.DownloadError):
+import hashlib
+import json
+import logging
+import logging.handlers
+import math
+import queue
+import re
+import sqlite3
+import sys
+import threading
+from urllib.parse import urlparse, parse_qs
+
+# --- Exceções Customizadas ---
+# Não herdam de yt_dlp.utils.DownloadError: o yt-dlp só é importado depois que o bot já está no ar.
+class AgeRestrictionError(Exception):
     def __init__(self, original_query, underlying_exception):
         super().__init__(str(underlying_exception))
         self.original_query = original_query
+        self.underlying_exception = underlying_exception
+
+class ExtractionError(Exception):
+    pass
 
 # --- Configuração ---
 import os
-TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
-if not TOKEN:
-    raise ValueError("Token do Discord não encontrado na variável de ambiente DISCORD_BOT_TOKEN")"  # IMPORTANTE: Substitua e use variáveis de ambiente!
+TOKEN = os.environ.get("DISCORD_BOT_TOKEN") # Verificado em main(), para o módulo poder ser importado pelo harness.py
 COMMAND_PREFIX = "!"
+ENABLE_PREFIX_COMMANDS = os.environ.get("BOT_PREFIX_COMMANDS", "1") == "1"  # "0" dispensa a intent privilegiada message_content
+SYNC_APP_COMMANDS = os.environ.get("BOT_SYNC_APP_COMMANDS", "0") == "1"    # Publica os slash commands no startup (rate limit do Discord!)
 
 YDL_OPTS_DEFAULT = {
     'format': 'bestaudio[ext=opus]/bestaudio[ext=m4a]/bestaudio[abr<=128]/bestaudio/best',
@@ -38,6 +59,968 @@ FFMPEG_OPTS = {
     'options': '-vn'
 }
 
+AUDIO_MAX_ABR = os.environ.get("BOT_AUDIO_MAX_ABR")                  # kbps; limita o bitrate escolhido pelo yt-dlp
+FFMPEG_LOW_CPU = os.environ.get("BOT_FFMPEG_LOW_CPU", "0") == "1"     # Um thread de decodificação por processo
+if AUDIO_MAX_ABR:
+    YDL_OPTS_DEFAULT['format'] = (f"bestaudio[ext=opus][abr<={AUDIO_MAX_ABR}]/bestaudio[ext=m4a][abr<={AUDIO_MAX_ABR}]/"
+                                  f"bestaudio[abr<={AUDIO_MAX_ABR}]/" + YDL_OPTS_DEFAULT['format'])
+
+# Perfis do FFmpeg por tipo de fonte. "fast" usa probe agressivo (início mais rápido);
+# "safe" deixa o FFmpeg analisar a entrada e é usado quando o "fast" falha demais.
+_FFMPEG_RECONNECT = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+FFMPEG_PROFILES = {
+    'youtube_opus': {'fast': f'{_FFMPEG_RECONNECT} -probesize 32k -analyzeduration 0',
+                     'safe': f'{_FFMPEG_RECONNECT} -probesize 256k'},
+    'm4a':          {'fast': f'{_FFMPEG_RECONNECT} -probesize 128k -analyzeduration 0',
+                     'safe': f'{_FFMPEG_RECONNECT}'},
+    'hls':          {'fast': f'{_FFMPEG_RECONNECT} -reconnect_on_network_error 1 -probesize 512k',
+                     'safe': f'{_FFMPEG_RECONNECT} -reconnect_on_network_error 1'},
+    'local':        {'fast': '-probesize 32k -analyzeduration 0',
+                     'safe': ''},
+    'default':      {'fast': FFMPEG_OPTS['before_options'],
+                     'safe': f'{_FFMPEG_RECONNECT}'},
+}
+FFMPEG_MAX_PROCESSES = int(os.environ.get("BOT_FFMPEG_MAX_PROCESSES", "200"))   # Transcoders simultâneos no processo
+FFMPEG_ORPHAN_GRACE = float(os.environ.get("BOT_FFMPEG_ORPHAN_GRACE", "30"))    # Segundos sem player antes de matar o processo
+# Admissão de pedidos que disparam extração (!play, !replay): token bucket por usuário, por servidor e global.
+PLAY_USER_BURST = int(os.environ.get("BOT_PLAY_USER_BURST", "3"))
+PLAY_USER_PER_MINUTE = float(os.environ.get("BOT_PLAY_USER_PER_MINUTE", "6"))
+PLAY_GUILD_BURST = int(os.environ.get("BOT_PLAY_GUILD_BURST", "10"))
+PLAY_GUILD_PER_MINUTE = float(os.environ.get("BOT_PLAY_GUILD_PER_MINUTE", "30"))
+PLAY_GLOBAL_BURST = int(os.environ.get("BOT_PLAY_GLOBAL_BURST", "20"))
+PLAY_GLOBAL_PER_SECOND = float(os.environ.get("BOT_PLAY_GLOBAL_PER_SECOND", "5"))
+MAX_QUEUE_LENGTH = int(os.environ.get("BOT_MAX_QUEUE_LENGTH", "500"))          # Músicas por servidor
+INTERACTIVE_EXTRACTION_LIMIT = int(os.environ.get("BOT_INTERACTIVE_EXTRACTIONS", "8")) # Acima disso, !play vai para a fila de resolução
+PENDING_RESOLUTIONS_MAX = int(os.environ.get("BOT_PENDING_RESOLUTIONS_MAX", "200"))
+RESOLUTION_WORKERS = int(os.environ.get("BOT_RESOLUTION_WORKERS", "2"))
+RESUME_MAX_ATTEMPTS = int(os.environ.get("BOT_RESUME_MAX_ATTEMPTS", "3"))  # Retomadas automáticas por música
+RESUME_MIN_REMAINING = 5.0 # Segundos: fim de stream mais perto que isso do final conta como fim normal
+PROFILE_MIN_SAMPLES = 5          # Reproduções antes de julgar um perfil
+PROFILE_FAILURE_THRESHOLD = 0.2  # Falhas de início (+ reconexões ponderadas) por reprodução
+PROFILE_REPROBE_EVERY = 25       # A cada N reproduções volta a testar o "fast"
+
+HISTORY_DB_PATH = os.environ.get("BOT_HISTORY_DB", "historico.db")
+HISTORY_DEPTH = int(os.environ.get("BOT_HISTORY_DEPTH", "500"))            # Registros persistidos por servidor
+HISTORY_MEMORY_DEPTH = int(os.environ.get("BOT_HISTORY_MEMORY_DEPTH", "50")) # Pilha em memória usada pelo botão "Anterior"
+
+STREAM_CACHE_TTL = int(os.environ.get("BOT_STREAM_CACHE_TTL", "1800"))          # Segundos, quando a URL não informa expiração
+STREAM_CACHE_MAX_ENTRIES = int(os.environ.get("BOT_STREAM_CACHE_MAX", "2000"))
+
+WARMER_TOP_N = int(os.environ.get("BOT_WARMER_TOP_N", "50"))                  # Quantas das mais tocadas aquecer
+WARMER_INTERVAL_MINUTES = int(os.environ.get("BOT_WARMER_INTERVAL_MINUTES", "30"))
+WARMER_OFFPEAK_HOURS = os.environ.get("BOT_WARMER_OFFPEAK_HOURS", "3-8")       # Janela local "início-fim" (pode virar a meia-noite)
+WARMER_MIN_INTERVAL = float(os.environ.get("BOT_WARMER_MIN_INTERVAL", "2.0"))  # Pausa mínima entre extrações do aquecedor
+WARMER_DOWNLOAD_AUDIO = os.environ.get("BOT_WARMER_DOWNLOAD_AUDIO", "0") == "1"
+AUDIO_CACHE_DIR = os.environ.get("BOT_AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_MB = int(os.environ.get("BOT_AUDIO_CACHE_MAX_MB", "2048"))
+
+VOLUME_MAX = int(os.environ.get("BOT_VOLUME_MAX", "200"))                    # Em %, limite do !volume
+BASS_BOOST_LEVELS = (0.0, 0.6, 1.2, 2.0)  # Ganho somado dos graves (abaixo de ~150 Hz) por nível do !bass: 0, +4, +7, +10 dB
+BASS_DECIMATION = 16                      # Os graves são filtrados a 3 kHz (48 kHz / 16) e interpolados de volta
+BASS_BOX_LENGTH = 8                       # Janela (amostras a 3 kHz) de cada estágio do passa-baixa; 2 estágios -> corte em ~150 Hz
+NORMALIZE_TARGET_RMS = 0.12               # Nível alvo do !normalize (fração da escala cheia, ~ -18 dBFS)
+NORMALIZE_MAX_GAIN = 4.0
+NORMALIZE_SMOOTHING = 0.05                # Fração do caminho até o ganho alvo percorrida a cada frame de 20 ms
+
+LOG_LEVEL = os.environ.get("BOT_LOG_LEVEL", "INFO").upper()
+LOG_DEDUP_WINDOW = float(os.environ.get("BOT_LOG_DEDUP_WINDOW", "60"))       # Segundos em que o mesmo erro é registrado uma vez só
+LOG_SAMPLE_WINDOW = float(os.environ.get("BOT_LOG_SAMPLE_WINDOW", "10"))     # Janela da contagem de erros/avisos
+LOG_SAMPLE_THRESHOLD = int(os.environ.get("BOT_LOG_SAMPLE_THRESHOLD", "50")) # Acima disso na janela, passa a amostrar
+LOG_SAMPLE_EVERY = int(os.environ.get("BOT_LOG_SAMPLE_EVERY", "20"))         # Durante a amostragem, registra 1 a cada N
+
+# --- Logging Estruturado ---
+# O loop de eventos só enfileira o LogRecord; formatação em JSON e escrita no stdout ficam numa thread
+# do QueueListener. Avisos/erros repetidos são deduplicados e, numa rajada, amostrados antes de enfileirar.
+log = logging.getLogger("bot_musica")
+_LOG_CONTEXT_FIELDS = ('guild_id', 'command', 'pid', 'query', 'repeated', 'sampled_1_in', 'dropped')
+# URLs, trechos entre aspas, "[extractor] id:" do yt-dlp e números variam a cada ocorrência do mesmo erro.
+_LOG_VARIABLE_PARTS = re.compile(r"https?://\S+|'[^']*'|\"[^\"]*\"|\[\w+\] [\w-]+:|\d+")
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in _LOG_CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ErrorSamplingFilter(logging.Filter):
+    # Só atua em WARNING ou acima. Roda na thread de quem loga, então precisa ser barato.
+    MAX_KEYS = 1024
+
+    def __init__(self, dedup_window=LOG_DEDUP_WINDOW, sample_window=LOG_SAMPLE_WINDOW,
+                 sample_threshold=LOG_SAMPLE_THRESHOLD, sample_every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.dedup_window = dedup_window
+        self.sample_window = sample_window
+        self.sample_threshold = sample_threshold
+        self.sample_every = sample_every
+        self._lock = threading.Lock()
+        self._seen = collections.OrderedDict()  # mensagem -> [primeiro registro, suprimidos desde então]
+        self._window_started = time.monotonic()
+        self._window_count = 0
+        self._window_dropped = 0
+        self._dropped_pending = 0
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        # O guild_id fica fora da mensagem (vai em extra), então o mesmo erro em vários servidores tem a mesma chave.
+        key = (record.levelno, _LOG_VARIABLE_PARTS.sub("#", record.getMessage()))
+        with self._lock:
+            if now - self._window_started >= self.sample_window:
+                self._dropped_pending += self._window_dropped
+                self._window_started, self._window_count, self._window_dropped = now, 0, 0
+            self._window_count += 1
+
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.dedup_window:
+                seen[1] += 1
+                self.suppressed_total += 1
+                return False
+            if seen is not None and seen[1]:
+                record.repeated = seen[1]  # Quantas vezes foi suprimido na janela anterior
+            self._seen[key] = [now, 0]
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.MAX_KEYS:
+                self._seen.popitem(last=False)
+
+            if self._window_count > self.sample_threshold:
+                if self._window_count % self.sample_every:
+                    self._window_dropped += 1
+                    self.suppressed_total += 1
+                    return False
+                record.sampled_1_in = self.sample_every
+            if self._dropped_pending:
+                record.dropped = self._dropped_pending
+                self._dropped_pending = 0
+        return True
+
+class _PassthroughQueueHandler(logging.handlers.QueueHandler):
+    # O prepare() padrão formata a mensagem (e o traceback) na thread de quem loga; aqui isso fica
+    # para o listener. Seguro porque a fila é em memória, sem pickle.
+    def prepare(self, record):
+        return record
+
+def setup_logging(stream=None):
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonLineFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    queue_handler = _PassthroughQueueHandler(log_queue)
+    queue_handler.addFilter(ErrorSamplingFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("discord").setLevel(max(logging.INFO, root.level))  # DEBUG do gateway é muito verboso
+    listener.start()
+    return listener
+
+# --- Carregamento Preguiçoso do yt-dlp ---
+# O yt-dlp (e a tabela de extractors) é a parte mais pesada da inicialização. Ele é carregado numa thread
+# em segundo plano enquanto o gateway conecta; quem precisar dele antes disso espera no lock.
+yt_dlp = None
+_ytdlp_lock = threading.Lock()
+STARTUP_TIMINGS = {}  # Fase -> segundos desde o início do processo
+
+def _mark_startup(phase):
+    STARTUP_TIMINGS.setdefault(phase, time.perf_counter() - _PROCESS_STARTED)
+
+def _load_ytdlp():
+    global yt_dlp
+    with _ytdlp_lock:
+        if yt_dlp is None:
+            import yt_dlp as ytdlp_module
+            # A primeira instância monta a lista de extractors; feito aqui, o primeiro !play não paga esse custo.
+            with ytdlp_module.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+                ydl.get_info_extractor('Youtube')
+            yt_dlp = ytdlp_module
+            _mark_startup('yt_dlp_ready')
+    return yt_dlp
+
+def ytdlp_ready():
+    return yt_dlp is not None
+
+# --- Efeitos de Áudio ---
+# Aplicados em Python sobre o PCM que o FFmpeg já entrega (s16le, 48 kHz, estéreo), dentro do read() do source:
+# mudar volume/graves não reinicia o FFmpeg. O NumPy só é importado quando algum efeito é ligado.
+np = None
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+class AudioEffects:
+    # Um por servidor, compartilhado pelos sources da música atual. Os comandos alteram volume/bass_level/normalize
+    # no loop de eventos; o estado dos filtros (_history, _gain...) só é tocado pela thread do player.
+    _bass_kernels = {} # Frames por tamanho -> matriz do _bass_kernel; corrida entre threads só recalcula
+
+    def __init__(self):
+        self.volume = 1.0
+        self.bass_level = 0
+        self.normalize = False
+        self._gain = 1.0       # Ganho aplicado no fim do último frame; mudanças viram rampa dentro do próximo
+        self._norm_gain = 1.0
+        self._history = None   # Estado do passa-baixa dos graves entre frames (ver _bass_boost)
+
+    @property
+    def is_neutral(self) -> bool:
+        return self.volume == 1.0 and not self.bass_level and not self.normalize and self._gain == 1.0 and self._history is None
+
+    def describe(self) -> str:
+        bass = f"graves nível {self.bass_level}" if self.bass_level else "graves normais"
+        return f"volume {round(self.volume * 100)}%, {bass}, normalização {'ligada' if self.normalize else 'desligada'}"
+
+    @classmethod
+    def _bass_kernel(cls, blocks_per_frame):
+        # Passa-baixa + volta para 48 kHz numa matriz só (amostras do frame x blocos de BASS_DECIMATION amostras),
+        # calculada uma vez por tamanho de frame: por frame fica uma multiplicação em vez de dezenas de operações.
+        kernel = cls._bass_kernels.get(blocks_per_frame)
+        if kernel is None:
+            d, n = BASS_DECIMATION, BASS_BOX_LENGTH
+            taps = np.convolve(np.ones(n), np.ones(n)) / (n * n * d) # Dois filtros de média móvel em cascata, sobre somas de bloco
+            lowpass = np.zeros((blocks_per_frame + 1, blocks_per_frame + len(taps)))
+            for row in range(blocks_per_frame + 1):
+                lowpass[row, row:row + len(taps)] = taps
+            fractions = (np.arange(d) + 0.5) / d
+            upsample = np.zeros((blocks_per_frame * d, blocks_per_frame + 1)) # Interpolação linear entre blocos vizinhos
+            for block in range(blocks_per_frame):
+                upsample[block * d:(block + 1) * d, block] = 1 - fractions
+                upsample[block * d:(block + 1) * d, block + 1] = fractions
+            kernel = cls._bass_kernels[blocks_per_frame] = (upsample @ lowpass).astype(np.float32)
+        return kernel
+
+    def _bass_boost(self, samples, amount):
+        # Graves filtrados a 3 kHz: soma por bloco de BASS_DECIMATION amostras e _bass_kernel. O sinal original é
+        # atrasado pelo mesmo tanto que o filtro, para os graves somarem em fase.
+        d, n = BASS_DECIMATION, BASS_BOX_LENGTH
+        lag = (n - 1) * d - d // 2
+        if self._history is None:
+            self._history = (np.zeros((lag, 2), np.float32), np.zeros((2 * n - 1, 2), np.float32))
+        dry_history, block_history = self._history
+        dry = np.concatenate((dry_history, samples))
+        blocks = np.concatenate((block_history, np.add.reduceat(samples, np.arange(0, len(samples), d), axis=0)))
+        self._history = (dry[-lag:], blocks[-(2 * n - 1):])
+        return dry[:len(samples)] + amount * (self._bass_kernel(len(samples) // d) @ blocks)
+
+    def process(self, data: bytes) -> bytes:
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, 2).astype(np.float32)
+        if self.bass_level and len(samples) % BASS_DECIMATION == 0:
+            samples = self._bass_boost(samples, BASS_BOOST_LEVELS[self.bass_level])
+        else:
+            self._history = None
+
+        target = self.volume
+        if self.normalize:
+            flat = samples.ravel()
+            rms = (float(np.dot(flat, flat)) / len(flat)) ** 0.5 / 32768.0
+            if rms > 1e-3: # Silêncio não puxa o ganho para cima
+                desired = min(NORMALIZE_MAX_GAIN, max(1 / NORMALIZE_MAX_GAIN, NORMALIZE_TARGET_RMS / rms))
+                self._norm_gain += (desired - self._norm_gain) * NORMALIZE_SMOOTHING
+            target *= self._norm_gain
+        else:
+            self._norm_gain = 1.0
+
+        if target != self._gain:
+            # Rampa ao longo do frame: mudar o ganho de uma vez causa estalo.
+            step = (target - self._gain) / len(samples)
+            samples *= (np.arange(1, len(samples) + 1, dtype=np.float32) * step + self._gain)[:, None]
+            self._gain = target
+        elif target != 1.0:
+            samples *= target
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
+
+EFFECTS_ROUND_BUDGET = 0.010 # Fatia dos 20 ms de cada frame que os efeitos podem usar (o resto fica para Opus, envio e loop)
+
+def _effects_round_times(configure, sessions, frame_data):
+    # Tempo de cada rodada (um frame de cada sessão, em sequência), do menor para o maior.
+    chains = [AudioEffects() for _ in range(sessions)]
+    for fx in chains: configure(fx)
+    per_round = []
+    for data in frame_data:
+        started = time.perf_counter()
+        for fx in chains:
+            fx.process(data)
+        per_round.append(time.perf_counter() - started)
+    per_round.sort()
+    return per_round
+
+def _p99(per_round):
+    return per_round[min(len(per_round) - 1, int(len(per_round) * 0.99))]
+
+def benchmark_effects(sessions=300, frames=100):
+    # Custo por rodada de 20 ms (só volume, e todos os efeitos ligados), processando `sessions` servidores em sequência
+    # (como os players competem pelo GIL, o custo que importa é o somado por rodada). O que conta é o p99, não a média:
+    # uma rodada atrasada é um engasgo em todos os servidores. Depois procura quantas sessões cabem em EFFECTS_ROUND_BUDGET.
+    if _load_numpy() is None:
+        print("NumPy não instalado: efeitos indisponíveis.")
+        return
+    t = np.arange(960 * frames) / 48000
+    wave = 6000 * np.sin(2 * np.pi * 60 * t) + 3000 * np.sin(2 * np.pi * 1000 * t)
+    pcm = np.repeat(wave[:, None], 2, axis=1).astype(np.int16)
+    frame_data = [pcm[i * 960:(i + 1) * 960].tobytes() for i in range(frames)]
+    budget_ms = EFFECTS_ROUND_BUDGET * 1000
+    for label, configure in (("só volume", lambda fx: setattr(fx, 'volume', 0.5)),
+                             ("volume + graves + normalização", lambda fx: (setattr(fx, 'volume', 1.5),
+                                                                          setattr(fx, 'bass_level', 2),
+                                                                          setattr(fx, 'normalize', True)))):
+        per_round = _effects_round_times(configure, sessions, frame_data)
+        mean, p99 = sum(per_round) / len(per_round), _p99(per_round)
+        print(f"{label}: {mean / sessions * 1e6:.1f} µs/frame | rodada com {sessions} sessões: "
+              f"p99 {p99 * 1000:.2f} ms, média {mean * 1000:.2f} ms (frame: 20 ms, orçamento dos efeitos: {budget_ms:.0f} ms)")
+        # Estimativa pelo p99 por sessão, conferida medindo de novo; enquanto o p99 medido estourar, reduz e mede outra vez.
+        fits = max(1, int(sessions * EFFECTS_ROUND_BUDGET / p99))
+        fits_p99 = _p99(_effects_round_times(configure, fits, frame_data))
+        for _ in range(4):
+            if fits_p99 <= EFFECTS_ROUND_BUDGET or fits == 1:
+                break
+            fits = max(1, int(fits * 0.95 * EFFECTS_ROUND_BUDGET / fits_p99))
+            fits_p99 = _p99(_effects_round_times(configure, fits, frame_data))
+        verdict = "cabem" if fits_p99 <= EFFECTS_ROUND_BUDGET else "não coube nem com"
+        print(f"  {verdict} {fits} sessões no orçamento: p99 medido {fits_p99 * 1000:.2f} ms")
+
+# --- Perfis Adaptativos do FFmpeg ---
+def stream_format_of(info):
+    if not info:
+        return None
+    return {'ext': info.get('ext'), 'acodec': info.get('acodec'), 'protocol': info.get('protocol')}
+
+def select_ffmpeg_profile(stream_url: str, stream_format=None, is_local_file=False) -> str:
+    if is_local_file:
+        return 'local'
+    fmt = stream_format or {}
+    protocol = (fmt.get('protocol') or '').lower()
+    acodec = (fmt.get('acodec') or '').lower()
+    ext = (fmt.get('ext') or '').lower()
+    url_lower = (stream_url or '').lower()
+    if 'm3u8' in protocol or '.m3u8' in url_lower or ('sndcdn.com' in url_lower and '/playlist' in url_lower):
+        return 'hls'
+    if acodec == 'opus' or ext in ('opus', 'webm') or 'mime=audio%2fwebm' in url_lower:
+        return 'youtube_opus'
+    if acodec.startswith('mp4a') or ext == 'm4a' or 'mime=audio%2fmp4' in url_lower:
+        return 'm4a'
+    return 'default'
+
+class FFmpegProfileStats:
+    def __init__(self):
+        # (perfil, variante) -> últimas reproduções: (falhou_ao_iniciar, reconexões, tempo_de_início)
+        self._outcomes = collections.defaultdict(lambda: collections.deque(maxlen=50))
+        self._plays = collections.Counter()
+
+    def record(self, profile: str, variant: str, failed: bool, reconnects: int, startup_time):
+        self._outcomes[(profile, variant)].append((failed, reconnects, startup_time))
+
+    def _score(self, profile: str, variant: str):
+        outcomes = self._outcomes.get((profile, variant))
+        if not outcomes:
+            return None
+        return sum(f + 0.5 * r for f, r, _ in outcomes) / len(outcomes)
+
+    def choose_variant(self, profile: str) -> str:
+        self._plays[profile] += 1
+        fast = self._outcomes.get((profile, 'fast'))
+        if not fast or len(fast) < PROFILE_MIN_SAMPLES or self._plays[profile] % PROFILE_REPROBE_EVERY == 0:
+            return 'fast'
+        fast_score = self._score(profile, 'fast')
+        safe_score = self._score(profile, 'safe')
+        if fast_score > PROFILE_FAILURE_THRESHOLD and (safe_score is None or safe_score < fast_score):
+            return 'safe'
+        return 'fast'
+
+    def ffmpeg_options(self, profile: str, variant: str) -> dict:
+        options = '-vn -threads 1' if FFMPEG_LOW_CPU else '-vn'
+        return {'before_options': FFMPEG_PROFILES[profile][variant], 'options': options}
+
+    def summary(self):
+        rows = []
+        for (profile, variant), outcomes in sorted(self._outcomes.items()):
+            startups = sorted(t for _, _, t in outcomes if t is not None)
+            median = startups[len(startups) // 2] if startups else None
+            rows.append({'profile': profile, 'variant': variant, 'plays': len(outcomes),
+                         'failures': sum(1 for f, _, _ in outcomes if f),
+                         'reconnects': sum(r for _, r, _ in outcomes),
+                         'median_startup': median})
+        return rows
+
+class _FFmpegStderrWatcher:
+    # Conta as reconexões HTTP no stderr do FFmpeg. O stderr é um pipe lido pelo próprio loop de eventos
+    # (add_reader): nada de thread por processo, e o EOF (FFmpeg saiu) fecha o leitor. Precisa ser um arquivo
+    # de verdade: sem fileno() o discord.py cria uma thread que gira sem parar quando o FFmpeg fecha o stderr.
+    def __init__(self):
+        self.reconnects = 0
+        self._tail = b""
+        self._read_fd = None
+        try:
+            self._loop = asyncio.get_running_loop()
+            read_fd, write_fd = os.pipe()
+        except (RuntimeError, OSError): # Fora do loop: sem contagem de reconexões
+            self.stderr = open(os.devnull, 'wb')
+            return
+        try:
+            os.set_blocking(read_fd, False)
+            self._loop.add_reader(read_fd, self._on_readable)
+        except (NotImplementedError, OSError): # Ex.: ProactorEventLoop no Windows não observa pipes
+            os.close(read_fd)
+            os.close(write_fd)
+            self.stderr = open(os.devnull, 'wb')
+            return
+        self._read_fd = read_fd
+        self.stderr = os.fdopen(write_fd, 'wb') # O que vai para o Popen
+
+    def close_writer(self):
+        # O FFmpeg já herdou o lado de escrita; fechá-lo aqui é o que faz o EOF chegar quando ele sair.
+        self.stderr.close()
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._read_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.reconnects += self._tail.count(b"Will reconnect at")
+            return self.close()
+        lines, _, tail = (self._tail + data).rpartition(b"\n")
+        self._tail = tail[-256:] # Linha incompleta: termina na próxima leitura
+        self.reconnects += lines.count(b"Will reconnect at")
+
+    def close(self):
+        # Só no loop de eventos (EOF, ou falha ao iniciar o FFmpeg).
+        if self._read_fd is not None:
+            self._loop.remove_reader(self._read_fd)
+            os.close(self._read_fd)
+            self._read_fd = None
+
+class MonitoredFFmpegPCMAudio(discord.FFmpegPCMAudio):
+    # Mede o tempo até o primeiro frame e reporta o resultado ao FFmpegProfileStats ao terminar.
+    FRAME_SECONDS = 0.02 # Cada read() entrega 20 ms de PCM
+
+    def __init__(self, source, *, profile: str, variant: str, stats: FFmpegProfileStats, start_offset: float = 0.0,
+                 effects: AudioEffects = None, **ffmpeg_opts):
+        self.profile = profile
+        self.variant = variant
+        self.effects = effects # AudioEffects do servidor (None enquanto nenhum efeito foi configurado)
+        self.on_cleanup = None # Definido pelo FFmpegSupervisor
+        self.deliberate = False # Encerrado de propósito (skip, stop, seek, abort): não é falha de início do FFmpeg
+        self.start_offset = start_offset
+        self.frames_read = 0
+        self.startup_time = None
+        self._stats = stats
+        self._reported = False
+        self._stderr_watcher = _FFmpegStderrWatcher()
+        self._created_at = time.perf_counter()
+        try:
+            super().__init__(source, stderr=self._stderr_watcher.stderr, **ffmpeg_opts)
+        except Exception:
+            self._stderr_watcher.close()
+            raise
+        finally:
+            self._stderr_watcher.close_writer()
+
+    def read(self) -> bytes:
+        data = super().read()
+        if data:
+            if self.frames_read == 0:
+                self.startup_time = time.perf_counter() - self._created_at
+            self.frames_read += 1
+            effects = self.effects
+            if effects is not None and not effects.is_neutral:
+                data = effects.process(data)
+        return data
+
+    def discard(self):
+        # Cleanup pedido pelo bot, não pelo fim/falha do stream.
+        self.deliberate = True
+        self.cleanup()
+
+    def cleanup(self):
+        if not self._reported:
+            self._reported = True
+            # Morto de propósito antes do primeiro frame não diz nada sobre o perfil: não entra na estatística.
+            if self.frames_read or not self.deliberate:
+                self._stats.record(self.profile, self.variant, self.frames_read == 0,
+                                   self._stderr_watcher.reconnects, self.startup_time)
+        super().cleanup()
+        if self.on_cleanup:
+            callback, self.on_cleanup = self.on_cleanup, None
+            callback(self)
+
+    @property
+    def position(self) -> float:
+        # Relógio de reprodução: segundos de áudio realmente entregues ao Discord.
+        return self.start_offset + self.frames_read * self.FRAME_SECONDS
+
+    @property
+    def pid(self):
+        process = getattr(self, '_process', None)
+        return getattr(process, 'pid', None)
+
+    def is_running(self) -> bool:
+        process = getattr(self, '_process', None)
+        try: return bool(process) and process.poll() is None
+        except Exception: return False
+
+def parse_timestamp(text: str) -> float:
+    # "90", "1:30" ou "1:02:03" -> segundos. ValueError se inválido.
+    parts = text.strip().split(":")
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(text)
+    seconds = 0.0
+    for part in parts:
+        value = float(part)
+        if not math.isfinite(value) or value < 0: raise ValueError(text) # float() aceita "nan" e "inf"
+        seconds = seconds * 60 + value
+    return seconds
+
+def format_timestamp(seconds) -> str:
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}" if h > 0 else f"{m:02d}:{s:02d}"
+
+# --- Supervisão dos Processos FFmpeg ---
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def _read_proc_usage(pid: int):
+    # (segundos de CPU, RSS em bytes) via /proc; None fora do Linux ou se o processo já saiu.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        with open(f"/proc/{pid}/statm") as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss_bytes
+    except (OSError, IndexError, ValueError):
+        return None
+
+class FFmpegSupervisor:
+    # Controla todos os FFmpeg: limite global (com fila de espera), registro por servidor e limpeza de órfãos.
+    def __init__(self, max_processes: int = FFMPEG_MAX_PROCESSES):
+        self.max_processes = max_processes
+        self._slots = asyncio.Semaphore(max_processes)
+        self._lock = threading.Lock() # cleanup() do source roda na thread do player de áudio
+        self._active = {}             # source -> {'guild_id', 'started_at', 'orphan_since', 'last_cpu': (t, cpu)}
+        self._loop = None
+        self.waiting = 0
+        self.spawned_total = 0
+        self.orphans_killed = 0
+
+    async def spawn(self, guild_id: int, factory):
+        self._loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            source = factory()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._active[source] = {'guild_id': guild_id, 'started_at': time.monotonic(), 'orphan_since': None, 'last_cpu': None}
+        self.spawned_total += 1
+        source.on_cleanup = self._on_source_cleanup
+        return source
+
+    def _on_source_cleanup(self, source):
+        with self._lock:
+            released = self._active.pop(source, None) is not None
+        if released and self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._slots.release)
+
+    def sources_for_guild(self, guild_id: int):
+        with self._lock:
+            return [src for src, meta in self._active.items() if meta['guild_id'] == guild_id]
+
+    def kill_guild(self, guild_id: int) -> int:
+        killed = 0
+        for source in self.sources_for_guild(guild_id):
+            try: source.discard()
+            except Exception as e: log.warning("Erro ao encerrar FFmpeg: %s", e, extra={'guild_id': guild_id, 'pid': source.pid})
+            killed += 1
+        return killed
+
+    def kill_all(self) -> int:
+        with self._lock:
+            guild_ids = {meta['guild_id'] for meta in self._active.values()}
+        return sum(self.kill_guild(guild_id) for guild_id in guild_ids)
+
+    def sweep(self, bot) -> int:
+        # Mata processos que ficaram sem player por mais de FFMPEG_ORPHAN_GRACE (ou que terminaram sem player).
+        # Um source ainda no player nunca é órfão, mesmo com o processo encerrado: o FFmpeg sai ao escrever o
+        # fim no pipe, ~0,3 s antes de o player terminar de ler, e o próprio player faz o cleanup no fim.
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._active.items())
+        killed = 0
+        for source, meta in items:
+            guild = bot.get_guild(meta['guild_id'])
+            vc = guild.voice_client if guild else None
+            attached = vc is not None and vc.is_connected() and vc.source is source
+            if attached:
+                meta['orphan_since'] = None
+                continue
+            if meta['orphan_since'] is None:
+                meta['orphan_since'] = now
+            if source.is_running() and now - meta['orphan_since'] < FFMPEG_ORPHAN_GRACE:
+                continue
+            log.warning("FFmpeg órfão encerrado pelo supervisor.", extra={'guild_id': meta['guild_id'], 'pid': source.pid})
+            try: source.discard()
+            except Exception: pass
+            killed += 1
+        self.orphans_killed += killed
+        return killed
+
+    def process_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._active.items())
+        stats = []
+        for source, meta in items:
+            pid = source.pid
+            usage = _read_proc_usage(pid) if pid else None
+            cpu_percent = rss_mb = None
+            if usage:
+                cpu_seconds, rss_bytes = usage
+                rss_mb = rss_bytes / (1024 * 1024)
+                previous = meta['last_cpu'] or (meta['started_at'], 0.0)
+                elapsed = now - previous[0]
+                if elapsed > 0:
+                    cpu_percent = 100.0 * (cpu_seconds - previous[1]) / elapsed
+                meta['last_cpu'] = (now, cpu_seconds)
+            stats.append({'guild_id': meta['guild_id'], 'pid': pid, 'profile': getattr(source, 'profile', None),
+                          'age': now - meta['started_at'], 'cpu_percent': cpu_percent, 'rss_mb': rss_mb})
+        return stats
+
+    def __len__(self):
+        with self._lock:
+            return len(self._active)
+
+# --- Controle de Admissão ---
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def available(self, now: float = None) -> bool:
+        self._refill(now or time.monotonic())
+        return self.tokens >= 1
+
+    def take(self, now: float = None) -> bool:
+        self._refill(now or time.monotonic())
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def retry_after(self) -> float:
+        if self.tokens >= 1 or self.refill_per_second <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.refill_per_second
+
+class AdmissionController:
+    ADMITTED, USER_LIMITED, GUILD_LIMITED, BUSY = "admitted", "user_limited", "guild_limited", "busy"
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._user_buckets = {}
+        self._guild_buckets = {}
+        self.global_bucket = TokenBucket(PLAY_GLOBAL_BURST, PLAY_GLOBAL_PER_SECOND)
+        self.rejected = collections.Counter()
+
+    def _bucket(self, buckets: dict, key, capacity, per_minute):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.MAX_BUCKETS:
+                # Buckets cheios equivalem a buckets novos: podem ser descartados.
+                now = time.monotonic()
+                for stale_key in [k for k, b in buckets.items() if b.available(now) and b.tokens >= b.capacity]:
+                    del buckets[stale_key]
+            bucket = buckets[key] = TokenBucket(capacity, per_minute / 60.0)
+        return bucket
+
+    def admit(self, user_id: int, guild_id: int):
+        # Retorna (decisão, segundos para tentar de novo). BUSY = aceito, mas deve aguardar o limite global.
+        now = time.monotonic()
+        user_bucket = self._bucket(self._user_buckets, user_id, PLAY_USER_BURST, PLAY_USER_PER_MINUTE)
+        guild_bucket = self._bucket(self._guild_buckets, guild_id, PLAY_GUILD_BURST, PLAY_GUILD_PER_MINUTE)
+        if not user_bucket.available(now):
+            self.rejected[self.USER_LIMITED] += 1
+            return self.USER_LIMITED, user_bucket.retry_after()
+        if not guild_bucket.available(now):
+            self.rejected[self.GUILD_LIMITED] += 1
+            return self.GUILD_LIMITED, guild_bucket.retry_after()
+        user_bucket.take(now)
+        guild_bucket.take(now)
+        if not self.global_bucket.take(now):
+            return self.BUSY, self.global_bucket.retry_after()
+        return self.ADMITTED, 0.0
+
+    async def wait_global(self):
+        while not self.global_bucket.take():
+            await asyncio.sleep(max(self.global_bucket.retry_after(), 0.01))
+
+# --- Cache de URLs de Stream ---
+# Guarda o resultado de extrações (stream_url, título, duração) por webpage_url até a URL expirar.
+class StreamInfoCache:
+    EXPIRY_MARGIN = 600 # Descarta a URL 10 min antes da expiração informada pelo servidor
+
+    def __init__(self, ttl: int = STREAM_CACHE_TTL, max_entries: int = STREAM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def expires_at(self, stream_url: str) -> float:
+        now = time.time()
+        try:
+            expire = parse_qs(urlparse(stream_url).query).get('expire')
+            if expire:
+                return min(float(expire[0]) - self.EXPIRY_MARGIN, now + 6 * 3600)
+        except (ValueError, TypeError):
+            pass
+        return now + self.ttl
+
+    def get(self, webpage_url: str):
+        entry = self._entries.get(webpage_url)
+        if not entry:
+            return None
+        if entry['expires_at'] <= time.time():
+            self._entries.pop(webpage_url, None)
+            return None
+        self._entries.move_to_end(webpage_url)
+        return entry
+
+    def put(self, webpage_url: str, stream_url: str, title=None, duration=None, stream_format=None):
+        if not webpage_url or not stream_url:
+            return
+        self._entries[webpage_url] = {
+            'webpage_url': webpage_url, 'stream_url': stream_url, 'title': title, 'duration': duration,
+            'stream_format': stream_format, 'expires_at': self.expires_at(stream_url)
+        }
+        self._entries.move_to_end(webpage_url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def search(self, text: str, limit: int = 25):
+        text = text.lower()
+        now = time.time()
+        results = []
+        for entry in reversed(self._entries.values()):
+            if entry['expires_at'] > now and entry.get('title') and text in entry['title'].lower():
+                results.append(entry)
+                if len(results) >= limit: break
+        return results
+
+    def invalidate(self, webpage_url: str):
+        self._entries.pop(webpage_url, None)
+
+    def __contains__(self, webpage_url):
+        return self.get(webpage_url) is not None
+
+def canonical_video_url(query: str):
+    # URL de um vídeo -> chave do StreamInfoCache (a webpage_url que o yt-dlp devolve). None se não for URL.
+    parsed = urlparse(query.strip())
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return None
+    host = parsed.hostname.lower()
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parsed.path.strip('/').split('/')[0]
+    elif host.endswith('youtube.com'):
+        if parsed.path == '/watch':
+            video_id = (parse_qs(parsed.query).get('v') or [None])[0]
+        elif parsed.path.startswith('/shorts/'):
+            video_id = parsed.path.split('/')[2]
+    else:
+        return query.strip()
+    return f"https://www.youtube.com/watch?v={video_id}" if video_id else None
+
+def _audio_cache_key(webpage_url: str) -> str:
+    return hashlib.sha1(webpage_url.encode('utf-8')).hexdigest()
+
+class AudioCacheIndex:
+    # Chave (sha1 da webpage_url) -> arquivo baixado pelo aquecedor. Mantido em memória para o início de cada
+    # música não listar o diretório no loop de eventos; scan/add/prune rodam no executor do aquecedor.
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_mb: int = AUDIO_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.scanned = False
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def get(self, webpage_url: str):
+        if not webpage_url:
+            return None
+        with self._lock:
+            return self._paths.get(_audio_cache_key(webpage_url))
+
+    def scan(self):
+        # Arquivos que já estavam no disco antes do startup.
+        paths = {}
+        try: names = os.listdir(self.directory)
+        except OSError: names = []
+        for name in names:
+            key, dot, _ = name.partition(".")
+            if dot and not name.endswith(".part"):
+                paths[key] = os.path.join(self.directory, name)
+        with self._lock:
+            self._paths = paths
+        self.scanned = True
+
+    def add(self, webpage_url: str, path: str):
+        if path and os.path.isfile(path):
+            with self._lock:
+                self._paths[_audio_cache_key(webpage_url)] = path
+
+    def prune(self):
+        # Remove os arquivos menos recentemente usados até caber em max_bytes.
+        try:
+            files = [os.path.join(self.directory, n) for n in os.listdir(self.directory)]
+            files = [(f, os.stat(f)) for f in files if os.path.isfile(f)]
+        except OSError:
+            return
+        total = sum(st.st_size for _, st in files)
+        removed = set()
+        for path, st in sorted(files, key=lambda item: item[1].st_atime):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(path)
+                total -= st.st_size
+                removed.add(path)
+            except OSError: pass
+        if removed:
+            with self._lock:
+                self._paths = {key: path for key, path in self._paths.items() if path not in removed}
+
+def _is_offpeak_hour(hour: int, window: str = WARMER_OFFPEAK_HOURS) -> bool:
+    try:
+        start, end = (int(x) for x in window.split("-", 1))
+    except ValueError:
+        return False
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+# --- Histórico Persistente (ring buffer em SQLite) ---
+# Cada servidor tem no máximo HISTORY_DEPTH linhas: o slot é seq % depth, então um append
+# é um único INSERT OR REPLACE (custo constante) e o arquivo nunca cresce além do limite.
+class PlayHistoryStore:
+    def __init__(self, path: str = HISTORY_DB_PATH, depth: int = HISTORY_DEPTH):
+        self.depth = max(1, depth)
+        self._next_seq = {}
+        # Uma única thread serializa todo acesso ao SQLite, fora do event loop.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-db")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS plays ("
+                " guild_id INTEGER NOT NULL, slot INTEGER NOT NULL, seq INTEGER NOT NULL,"
+                " webpage_url TEXT NOT NULL, title TEXT, duration INTEGER, requester TEXT,"
+                " played_at REAL NOT NULL, PRIMARY KEY (guild_id, slot))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS plays_guild_seq ON plays (guild_id, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS plays_played_at ON plays (played_at)")
+            # Se a profundidade mudou, mantém as `depth` reproduções mais recentes de cada servidor (seq é
+            # contínuo por servidor) e renumera os slots para seq % depth. O passo pelos slots negativos evita
+            # colisão na chave primária durante o UPDATE.
+            self._conn.execute("DELETE FROM plays WHERE seq <= (SELECT MAX(p.seq) FROM plays p WHERE p.guild_id = plays.guild_id) - ?",
+                               (self.depth,))
+            if self._conn.execute("SELECT 1 FROM plays WHERE slot != seq % ? LIMIT 1", (self.depth,)).fetchone():
+                self._conn.execute("UPDATE plays SET slot = -1 - seq")
+                self._conn.execute("UPDATE plays SET slot = seq % ?", (self.depth,))
+
+    def _blocking_append(self, guild_id: int, song_data: dict, played_at: float):
+        seq = self._next_seq.get(guild_id)
+        if seq is None:
+            row = self._conn.execute("SELECT MAX(seq) FROM plays WHERE guild_id = ?", (guild_id,)).fetchone()
+            seq = (row[0] + 1) if row and row[0] is not None else 0
+        duration = song_data.get('duration')
+        try: duration = int(duration) if duration is not None else None
+        except (ValueError, TypeError): duration = None
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO plays (guild_id, slot, seq, webpage_url, title, duration, requester, played_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (guild_id, seq % self.depth, seq, song_data['webpage_url'], song_data.get('title'),
+                 duration, song_data.get('requester'), played_at))
+        self._next_seq[guild_id] = seq + 1
+
+    def _blocking_recent(self, guild_id: int, limit: int):
+        rows = self._conn.execute(
+            "SELECT webpage_url, title, duration, requester, played_at FROM plays"
+            " WHERE guild_id = ? ORDER BY seq DESC LIMIT ?", (guild_id, limit)).fetchall()
+        return [{'webpage_url': r[0], 'title': r[1], 'duration': r[2], 'requester': r[3], 'played_at': r[4]} for r in rows]
+
+    def _blocking_top_tracks(self, guild_id, since: float, limit: int):
+        query = ("SELECT webpage_url, MAX(title), MAX(duration), COUNT(*) AS plays FROM plays WHERE played_at >= ?"
+                 + (" AND guild_id = ?" if guild_id is not None else "")
+                 + " GROUP BY webpage_url ORDER BY plays DESC, MAX(played_at) DESC LIMIT ?")
+        params = (since, guild_id, limit) if guild_id is not None else (since, limit)
+        rows = self._conn.execute(query, params).fetchall()
+        return [{'webpage_url': r[0], 'title': r[1], 'duration': r[2], 'plays': r[3]} for r in rows]
+
+    def _blocking_search_titles(self, guild_id: int, text: str, limit: int):
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = self._conn.execute(
+            "SELECT webpage_url, MAX(title) FROM plays WHERE guild_id = ? AND title LIKE ? ESCAPE '\\'"
+            " GROUP BY webpage_url ORDER BY MAX(seq) DESC LIMIT ?", (guild_id, pattern, limit)).fetchall()
+        return [{'webpage_url': r[0], 'title': r[1]} for r in rows]
+
+    def record_play(self, guild_id: int, song_data: dict):
+        # Não bloqueia: o INSERT roda na thread do banco.
+        if not song_data or not song_data.get('webpage_url'):
+            return None
+        future = self._executor.submit(self._blocking_append, guild_id, dict(song_data), time.time())
+        future.add_done_callback(functools.partial(self._log_append_failure, guild_id)) # Quem chama não espera o resultado
+        return future
+
+    def _log_append_failure(self, guild_id: int, future):
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            log.warning("Falha ao gravar música no histórico: %s", error, exc_info=error, extra={'guild_id': guild_id})
+
+    async def recent(self, guild_id: int, limit: int = 10):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._blocking_recent, guild_id, limit)
+
+    async def search_titles(self, guild_id: int, text: str, limit: int = 25):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._blocking_search_titles, guild_id, text, limit)
+
+    async def top_tracks(self, guild_id: int = None, days: float = 7, limit: int = 10):
+        # guild_id=None agrega todos os servidores (usado pelos aquecedores de cache).
+        loop = asyncio.get_running_loop()
+        since = time.time() - days * 86400
+        return await loop.run_in_executor(self._executor, self._blocking_top_tracks, guild_id, since, limit)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
 # --- View dos Controles do Player ---
 class PlayerControlsView(discord.ui.View):
     def __init__(self, music_cog, guild_id: int):
@@ -76,15 +1059,15 @@ class PlayerControlsView(discord.ui.View):
                         new_msg = await interaction_or_message_channel.send(embed=embed, view=self)
                         self.music_cog.active_player_messages[self.guild_id] = new_msg
                     except Exception as e:
-                        print(f"Erro ao enviar nova mensagem de player (fallback): {e}")
+                        log.warning("Erro ao enviar nova mensagem de player (fallback): %s", e, extra={'guild_id': self.guild_id})
             except Exception as e: 
-                print(f"Erro ao editar mensagem do player: {e}")
+                log.warning("Erro ao editar mensagem do player: %s", e, extra={'guild_id': self.guild_id})
         elif isinstance(interaction_or_message_channel, discord.TextChannel):
             try:
                 new_msg = await interaction_or_message_channel.send(embed=embed, view=self)
                 self.music_cog.active_player_messages[self.guild_id] = new_msg
             except Exception as e:
-                print(f"Erro ao enviar mensagem inicial do player: {e}")
+                log.warning("Erro ao enviar mensagem inicial do player: %s", e, extra={'guild_id': self.guild_id})
 
 # --- Definições dos Botões ---
 class PreviousButton(discord.ui.Button):
@@ -113,7 +1096,7 @@ class PreviousButton(discord.ui.Button):
         queue.appendleft(prev_song_data) 
         
         if vc.is_playing() or vc.is_paused(): 
-            vc.stop()
+            self.music_cog._stop_current(self.guild_id, vc)
         else: 
             await self.music_cog.play_next_song(interaction.guild.id)
 
@@ -163,7 +1146,7 @@ class SkipButton(discord.ui.Button):
         vc = interaction.guild.voice_client
         if vc and (vc.is_playing() or vc.is_paused()): 
             self.music_cog.prefetched_stream_info.pop(self.guild_id, None)
-            vc.stop() 
+            self.music_cog._stop_current(self.guild_id, vc)
         else: 
             await interaction.followup.send("Nada tocando para pular.", ephemeral=True)
 
@@ -181,7 +1164,8 @@ class StopButton(discord.ui.Button):
 
 # --- Classe do Cog de Música ---
 class MusicCog(commands.Cog):
-    def __init__(self, bot):
+    def __init__(self, bot, extractor=None, history_store=None):
+        # extractor/history_store permitem trocar yt-dlp e o SQLite (ver harness.py).
         self.bot = bot
         self.song_queues = {}
         self.current_song_info = {}
@@ -190,12 +1174,50 @@ class MusicCog(commands.Cog):
         self.guild_music_channels = {} 
         self.prefetched_stream_info = {}
         self.YDL_OPTS = YDL_OPTS_DEFAULT
+        self.extract_info = extractor or self._blocking_extract_info
+        self.play_history = history_store or PlayHistoryStore()
+        self.stream_cache = StreamInfoCache()
+        self.audio_cache = AudioCacheIndex()
+        self._interactive_extractions = 0
+        # Executor próprio do aquecedor: nunca ocupa threads das extrações interativas.
+        self._warmer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-warmer")
+        self._warmed_at_startup = False
+        self.ffmpeg_profile_stats = FFmpegProfileStats()
+        self.ffmpeg_supervisor = FFmpegSupervisor()
+        self.current_stream = {}   # guild_id -> {'stream_url', 'stream_format', 'is_local_file', 'source'} da música atual
+        self._manual_stops = set() # Servidores cujo próximo fim de música foi pedido pelo usuário (skip/stop)
+        self._resume_attempts = {}
+        self._starting_playback = set()                  # Servidores com play_next_song em andamento
+        self._start_requested = set()                    # play_next_song chamado durante uma inicialização
+        self._play_generation = collections.Counter()    # Incrementado a cada limpeza; invalida inícios pendentes
+        self.admission = AdmissionController()
+        self._pending_resolutions = asyncio.Queue(maxsize=PENDING_RESOLUTIONS_MAX)
+        self._resolution_workers = []
+        self._ytdlp_preload = None  # Future do carregamento do yt-dlp em segundo plano (ver cog_load)
+        self.audio_effects = {}     # guild_id -> AudioEffects, criado no primeiro !volume/!bass/!normalize
+
+    async def cog_load(self):
+        # Não espera o yt-dlp: o cog entra no ar já, e as extrações aguardam o carregamento se chegarem antes.
+        if self.extract_info == self._blocking_extract_info and not ytdlp_ready():
+            # bot.loop só existe depois do login, e o setup() roda antes do bot.start().
+            self._ytdlp_preload = asyncio.get_running_loop().run_in_executor(None, _load_ytdlp)
+        self.cache_warmer_loop.start()
+        self.ffmpeg_watchdog_loop.start()
+
+    def cog_unload(self):
+        for worker in self._resolution_workers:
+            worker.cancel()
+        self.cache_warmer_loop.cancel()
+        self.ffmpeg_watchdog_loop.cancel()
+        self.ffmpeg_supervisor.kill_all()
+        self._warmer_executor.shutdown(wait=False, cancel_futures=True)
+        self.play_history.close()
 
     def get_queue(self, guild_id: int) -> collections.deque:
         return self.song_queues.setdefault(guild_id, collections.deque())
 
     def get_history(self, guild_id: int) -> collections.deque:
-        return self.song_history.setdefault(guild_id, collections.deque(maxlen=10))
+        return self.song_history.setdefault(guild_id, collections.deque(maxlen=HISTORY_MEMORY_DEPTH))
 
     def _create_song_embed(self, song_data, is_paused=False):
         title_prefix = "Tocando Agora" if not is_paused else "Pausado"
@@ -231,7 +1253,7 @@ class MusicCog(commands.Cog):
     async def _update_player_message(self, guild_id: int, song_data, is_paused=False):
         channel = self.guild_music_channels.get(guild_id)
         if not channel:
-            print(f"Alerta: Canal de música não encontrado para o servidor {guild_id} ao tentar atualizar player.")
+            log.warning("Canal de música não encontrado ao tentar atualizar player.", extra={'guild_id': guild_id})
             return
 
         view = PlayerControlsView(self, guild_id)
@@ -245,7 +1267,7 @@ class MusicCog(commands.Cog):
             except discord.NotFound:
                 self.active_player_messages.pop(guild_id, None)
             except Exception as e:
-                print(f"Erro ao editar mensagem do player existente: {e}")
+                log.warning("Erro ao editar mensagem do player existente: %s", e, extra={'guild_id': guild_id})
 
         try:
             old_msg_to_delete = self.active_player_messages.pop(guild_id, None)
@@ -256,7 +1278,7 @@ class MusicCog(commands.Cog):
             new_msg = await channel.send(embed=embed, view=view)
             self.active_player_messages[guild_id] = new_msg
         except Exception as e:
-            print(f"Erro crítico ao enviar nova mensagem do player: {e}")
+            log.error("Erro ao enviar nova mensagem do player: %s", e, extra={'guild_id': guild_id})
 
     def _blocking_extract_info(self, query_or_url, 
                                is_soundcloud_search=False, 
@@ -295,15 +1317,92 @@ class MusicCog(commands.Cog):
                 opts.pop('extract_flat', None)
                 if 'default_search' in opts:
                     del opts['default_search']
+        ydl_module = _load_ytdlp()
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
+            with ydl_module.YoutubeDL(opts) as ydl:
                 info = ydl.extract_info(final_query, download=False) 
             return info
-        except yt_dlp.utils.DownloadError as e:
+        except ydl_module.utils.DownloadError as e:
             if "Sign in to confirm your age" in str(e) and not is_soundcloud_search:
                 raise AgeRestrictionError(original_query=query_or_url, underlying_exception=e)
             raise 
 
+    async def _extract(self, query_or_url, **kwargs):
+        # Extração interativa (comandos e reprodução). O aquecedor cede a vez enquanto houver alguma em andamento.
+        self._interactive_extractions += 1
+        try:
+            return await self.bot.loop.run_in_executor(None, functools.partial(self.extract_info, query_or_url, **kwargs))
+        finally:
+            self._interactive_extractions -= 1
+
+    def _cache_stream_info(self, webpage_url, actual_info):
+        if actual_info and actual_info.get('url'):
+            self.stream_cache.put(webpage_url, actual_info['url'], actual_info.get('title'),
+                                  actual_info.get('duration'), stream_format_of(actual_info))
+
+    def _blocking_download_audio(self, webpage_url: str):
+        os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+        opts = self.YDL_OPTS.copy()
+        opts.pop('default_search', None)
+        opts['skip_download'] = False
+        opts['noplaylist'] = True
+        opts['outtmpl'] = os.path.join(AUDIO_CACHE_DIR, _audio_cache_key(webpage_url) + ".%(ext)s")
+        with _load_ytdlp().YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(webpage_url, download=True)
+            downloads = (info or {}).get('requested_downloads') or [{}]
+            path = downloads[0].get('filepath') or ydl.prepare_filename(info)
+        self.audio_cache.add(webpage_url, path)
+        self.audio_cache.prune()
+
+    @tasks.loop(seconds=15)
+    async def ffmpeg_watchdog_loop(self):
+        self.ffmpeg_supervisor.sweep(self.bot)
+
+    @ffmpeg_watchdog_loop.before_loop
+    async def before_ffmpeg_watchdog_loop(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=WARMER_INTERVAL_MINUTES)
+    async def cache_warmer_loop(self):
+        # Primeira execução logo no startup; as seguintes apenas no horário de baixo uso.
+        if self._warmed_at_startup and not _is_offpeak_hour(time.localtime().tm_hour):
+            return
+        self._warmed_at_startup = True
+        try:
+            await self.warm_cache()
+        except Exception as e:
+            log.exception("Erro no aquecimento de cache: %s", e)
+
+    async def warm_cache(self, limit: int = WARMER_TOP_N):
+        top = await self.play_history.top_tracks(None, days=7, limit=limit)
+        loop = asyncio.get_running_loop()
+        if not self.audio_cache.scanned:
+            await loop.run_in_executor(self._warmer_executor, self.audio_cache.scan)
+        warmed = 0
+        for track in top:
+            webpage_url = track['webpage_url']
+            needs_stream = webpage_url not in self.stream_cache
+            needs_audio = WARMER_DOWNLOAD_AUDIO and not self.audio_cache.get(webpage_url)
+            if not needs_stream and not needs_audio:
+                continue
+            # Nunca compete com extrações interativas.
+            while self._interactive_extractions > 0:
+                await asyncio.sleep(WARMER_MIN_INTERVAL)
+            try:
+                if needs_stream:
+                    info = await loop.run_in_executor(self._warmer_executor,
+                                                      functools.partial(self.extract_info, webpage_url, process_for_stream_url=True))
+                    actual_info = info.get('entries', [info])[0] if info and info.get('entries') else info
+                    self._cache_stream_info(webpage_url, actual_info)
+                if needs_audio:
+                    await loop.run_in_executor(self._warmer_executor, self._blocking_download_audio, webpage_url)
+                warmed += 1
+            except Exception as e:
+                log.warning("Aquecedor: falha ao pré-carregar: %s", e, extra={'query': webpage_url})
+            await asyncio.sleep(WARMER_MIN_INTERVAL)
+        if warmed:
+            log.info("Aquecedor: %d música(s) pré-carregada(s) de %d mais tocadas.", warmed, len(top))
+
     async def _prefetch_next_song_url(self, guild_id: int):
         queue = self.get_queue(guild_id)
         if not queue: 
@@ -317,18 +1416,28 @@ class MusicCog(commands.Cog):
            current_prefetch.get('stream_url'):
             return
 
+        cached = self.stream_cache.get(next_song_data_in_queue.get('webpage_url'))
+        if cached:
+            self.prefetched_stream_info[guild_id] = {
+                'webpage_url': cached['webpage_url'],
+                'stream_url': cached['stream_url'],
+                'title': cached.get('title') or next_song_data_in_queue.get('title', 'Título Desconhecido'),
+                'duration': cached.get('duration'),
+                'stream_format': cached.get('stream_format')
+            }
+            return
+
         self.prefetched_stream_info[guild_id] = {
             'webpage_url': next_song_data_in_queue.get('webpage_url'), 'stream_url': None, 'title': 'Prefetching...'
         }
         
         try:
-            info = await self.bot.loop.run_in_executor(None, 
-                functools.partial(self._blocking_extract_info, 
-                                  next_song_data_in_queue['webpage_url'], 
-                                  is_soundcloud_search=False, 
-                                  process_for_stream_url=True))
+            info = await self._extract(next_song_data_in_queue['webpage_url'], 
+                                       is_soundcloud_search=False, 
+                                       process_for_stream_url=True)
             
             actual_info = info.get('entries', [info])[0] if info and info.get('entries') else info
+            self._cache_stream_info(next_song_data_in_queue['webpage_url'], actual_info)
 
             if actual_info and 'url' in actual_info:
                 current_queue_after_prefetch = self.get_queue(guild_id) 
@@ -338,21 +1447,43 @@ class MusicCog(commands.Cog):
                         'webpage_url': next_song_data_in_queue['webpage_url'],
                         'stream_url': actual_info['url'],
                         'title': actual_info.get('title', 'Título Desconhecido'),
-                        'duration': actual_info.get('duration')
+                        'duration': actual_info.get('duration'),
+                        'stream_format': stream_format_of(actual_info)
                     }
                 else: self.prefetched_stream_info.pop(guild_id, None)
             else: self.prefetched_stream_info.pop(guild_id, None)
         except Exception as e:
-            print(f"Erro ao pré-carregar URL para '{next_song_data_in_queue.get('title', 'Desconhecida')}': {e}")
+            log.warning("Erro ao pré-carregar URL da próxima música: %s", e,
+                        extra={'guild_id': guild_id, 'query': next_song_data_in_queue.get('webpage_url')})
             self.prefetched_stream_info.pop(guild_id, None)
 
     async def play_next_song(self, guild_id: int):
+        # Só uma inicialização de música por servidor. Uma chamada que chega no meio (ex: a música nova falhou
+        # na hora enquanto a mensagem do player ainda era enviada) fica pendente e roda ao final, se nada
+        # estiver tocando; se a música iniciada está tocando, a chamada era redundante (skip + play, botões).
+        if guild_id in self._starting_playback:
+            self._start_requested.add(guild_id)
+            return
+        self._starting_playback.add(guild_id)
+        try:
+            while True:
+                self._start_requested.discard(guild_id)
+                await self._start_next_song(guild_id, self._play_generation[guild_id])
+                guild = self.bot.get_guild(guild_id)
+                vc = guild.voice_client if guild else None
+                if guild_id not in self._start_requested or not vc or vc.is_playing() or vc.is_paused():
+                    break
+        finally:
+            self._starting_playback.discard(guild_id)
+            self._start_requested.discard(guild_id)
+
+    async def _start_next_song(self, guild_id: int, generation: int):
         queue = self.get_queue(guild_id)
         history = self.get_history(guild_id)
         guild = self.bot.get_guild(guild_id)
         
         if not guild: 
-            print(f"Erro crítico: Guilda {guild_id} não encontrada.")
+            log.error("Servidor não encontrado ao iniciar próxima música.", extra={'guild_id': guild_id})
             return await self.cleanup_player_state(guild_id, "Erro interno (servidor não encontrado).")
             
         voice_client = guild.voice_client
@@ -363,7 +1494,7 @@ class MusicCog(commands.Cog):
             if channel_for_messages:
                 try: await channel_for_messages.send(msg, delete_after=30)
                 except: pass
-            else: print(f"Guild {guild_id}: {msg}")
+            else: log.info(msg, extra={'guild_id': guild_id})
             return await self.cleanup_player_state(guild_id)
         
         last_played_song = self.current_song_info.get(guild_id)
@@ -381,55 +1512,62 @@ class MusicCog(commands.Cog):
                     view = PlayerControlsView(self, guild_id)
                     await player_msg_obj.edit(embed=empty_embed, view=view)
                 except Exception as e_edit:
-                    print(f"Erro ao editar msg do player para fila vazia: {e_edit}")
+                    log.warning("Erro ao editar msg do player para fila vazia: %s", e_edit, extra={'guild_id': guild_id})
             elif channel_for_messages:
                 try: await channel_for_messages.send(msg, delete_after=30)
                 except: pass
-            else: print(f"Guild {guild_id}: {msg}")
+            else: log.info(msg, extra={'guild_id': guild_id})
             return
 
         song_to_play = queue.popleft()
         self.current_song_info[guild_id] = song_to_play
         
+        # >>> OTIMIZAÇÃO: Áudio já baixado pelo aquecedor de cache dispensa a rede <<<
+        local_audio_file = self.audio_cache.get(song_to_play.get('webpage_url'))
         # >>> OTIMIZAÇÃO: Verifica se a URL do stream já foi obtida pelo play_command <<<
-        stream_url = song_to_play.get('stream_url') 
+        stream_url = local_audio_file or song_to_play.get('stream_url') 
 
         if not stream_url: # Se não foi obtida antes (ex: item de playlist, ou não era a primeira música)
             prefetched = self.prefetched_stream_info.get(guild_id)
+            cached = self.stream_cache.get(song_to_play.get('webpage_url'))
             if prefetched and prefetched.get('webpage_url') == song_to_play.get('webpage_url') and prefetched.get('stream_url'):
                 stream_url = prefetched['stream_url']
                 song_to_play['title'] = prefetched.get('title', song_to_play.get('title'))
                 song_to_play['duration'] = prefetched.get('duration', song_to_play.get('duration'))
+                song_to_play['stream_format'] = prefetched.get('stream_format')
                 self.prefetched_stream_info.pop(guild_id, None)
+            elif cached:
+                stream_url = cached['stream_url']
+                song_to_play['title'] = cached.get('title') or song_to_play.get('title')
+                song_to_play['duration'] = cached.get('duration') or song_to_play.get('duration')
+                song_to_play['stream_format'] = cached.get('stream_format')
             else: 
                 try:
-                    info = await self.bot.loop.run_in_executor(None, 
-                        functools.partial(self._blocking_extract_info, 
-                                          song_to_play['webpage_url'], 
-                                          is_soundcloud_search=False,
-                                          process_for_stream_url=True))
+                    info = await self._extract(song_to_play['webpage_url'], 
+                                               is_soundcloud_search=False,
+                                               process_for_stream_url=True)
                     
                     actual_info = info.get('entries', [info])[0] if info and info.get('entries') else info
+                    self._cache_stream_info(song_to_play['webpage_url'], actual_info)
 
                     if actual_info and 'url' in actual_info: 
                         stream_url = actual_info['url']
                         song_to_play['title'] = actual_info.get('title', song_to_play.get('title'))
                         song_to_play['duration'] = actual_info.get('duration', song_to_play.get('duration'))
+                        song_to_play['stream_format'] = stream_format_of(actual_info)
                     else: 
-                        raise yt_dlp.utils.DownloadError("Informações de stream não encontradas (url faltando).")
+                        raise ExtractionError("Informações de stream não encontradas (url faltando).")
                 except AgeRestrictionError as are: 
                     if channel_for_messages: 
                         try: await channel_for_messages.send(f"'{song_to_play.get('title', 'Vídeo')}' tem restrição de idade. Tentando SoundCloud...", delete_after=25)
                         except: pass
                     try:
                         search_term_for_sc = song_to_play.get('title', are.original_query) 
-                        info_sc_meta = await self.bot.loop.run_in_executor(None, 
-                            functools.partial(self._blocking_extract_info, search_term_for_sc, is_soundcloud_search=True, process_for_stream_url=False))
+                        info_sc_meta = await self._extract(search_term_for_sc, is_soundcloud_search=True, process_for_stream_url=False)
                         entry_sc_meta = info_sc_meta.get('entries', [info_sc_meta])[0] if info_sc_meta and info_sc_meta.get('entries') else info_sc_meta
 
                         if entry_sc_meta and entry_sc_meta.get('webpage_url'):
-                            info_sc_stream = await self.bot.loop.run_in_executor(None, 
-                                functools.partial(self._blocking_extract_info, entry_sc_meta['webpage_url'], is_soundcloud_search=False, process_for_stream_url=True))
+                            info_sc_stream = await self._extract(entry_sc_meta['webpage_url'], is_soundcloud_search=False, process_for_stream_url=True)
                             actual_sc_stream_info = info_sc_stream.get('entries', [info_sc_stream])[0] if info_sc_stream and info_sc_stream.get('entries') else info_sc_stream
 
                             if actual_sc_stream_info and 'url' in actual_sc_stream_info:
@@ -437,8 +1575,9 @@ class MusicCog(commands.Cog):
                                 song_to_play['webpage_url'] = actual_sc_stream_info.get('webpage_url', song_to_play['webpage_url'])
                                 song_to_play['title'] = actual_sc_stream_info.get('title', song_to_play['title'])
                                 song_to_play['duration'] = actual_sc_stream_info.get('duration', song_to_play.get('duration'))
-                            else: raise yt_dlp.utils.DownloadError("Falha no SoundCloud (stream URL).")
-                        else: raise yt_dlp.utils.DownloadError("Falha no SoundCloud (metadados).")
+                                song_to_play['stream_format'] = stream_format_of(actual_sc_stream_info)
+                            else: raise ExtractionError("Falha no SoundCloud (stream URL).")
+                        else: raise ExtractionError("Falha no SoundCloud (metadados).")
                     except Exception as e_sc:
                         if channel_for_messages: 
                             try: await channel_for_messages.send(f"Falha ao buscar no SoundCloud para '{song_to_play.get('title', 'música')}': {e_sc}", delete_after=30)
@@ -456,9 +1595,26 @@ class MusicCog(commands.Cog):
                 except: pass
             return self.bot.loop.create_task(self.song_finished_handler(guild_id, "URL de stream não encontrada"))
         
+        source = None
         try:
-            source = discord.FFmpegPCMAudio(stream_url, **FFMPEG_OPTS)
-            voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.song_finished_handler(guild_id, e)))
+            # Espera um slot livre se o limite global de FFmpeg tiver sido atingido.
+            source = await self.ffmpeg_supervisor.spawn(guild_id, functools.partial(
+                self._create_audio_source, stream_url, song_to_play.get('stream_format'), bool(local_audio_file),
+                effects=self.audio_effects.get(guild_id)))
+            if not voice_client.is_connected():
+                source.discard()
+                return await self.cleanup_player_state(guild_id)
+            if self._play_generation[guild_id] != generation:
+                source.discard() # Stop/desconexão durante a extração: não começa a tocar
+                return
+            if local_audio_file:
+                try: os.utime(local_audio_file) # Marca como recente para a poda do cache
+                except OSError: pass
+            self.current_stream[guild_id] = {'stream_url': stream_url, 'stream_format': song_to_play.get('stream_format'),
+                                             'is_local_file': bool(local_audio_file)}
+            self._resume_attempts.pop(guild_id, None)
+            self._play_source(guild_id, voice_client, source)
+            self.play_history.record_play(guild_id, song_to_play)
             await self._update_player_message(guild_id, song_to_play, voice_client.is_paused())
             
             if queue:
@@ -466,24 +1622,161 @@ class MusicCog(commands.Cog):
             else:
                 self.prefetched_stream_info.pop(guild_id, None)
         except Exception as e:
+            if source is not None and voice_client.source is not source:
+                source.discard() # Nunca chegou ao player: evita processo órfão
             if channel_for_messages: 
                 try: await channel_for_messages.send(f"Erro crítico ao tentar tocar '{song_to_play['title']}': {e}", delete_after=25)
                 except: pass
             self.bot.loop.create_task(self.song_finished_handler(guild_id, e))
 
+    def _create_audio_source(self, stream_url: str, stream_format=None, is_local_file=False, start_at: float = 0.0, effects=None):
+        profile = select_ffmpeg_profile(stream_url, stream_format, is_local_file)
+        variant = self.ffmpeg_profile_stats.choose_variant(profile)
+        ffmpeg_opts = self.ffmpeg_profile_stats.ffmpeg_options(profile, variant)
+        if start_at > 0:
+            # -ss antes do -i: busca na entrada, sem decodificar o trecho pulado.
+            ffmpeg_opts['before_options'] = f"{ffmpeg_opts['before_options']} -ss {start_at:.2f}".strip()
+        return MonitoredFFmpegPCMAudio(stream_url, profile=profile, variant=variant, stats=self.ffmpeg_profile_stats,
+                                       start_offset=start_at, effects=effects, **ffmpeg_opts)
+
+    async def _effects_for(self, guild_id: int):
+        # Cria os efeitos do servidor na primeira vez e já os liga ao source que está tocando (vale na hora).
+        effects = self.audio_effects.get(guild_id)
+        if effects is None:
+            if await self.bot.loop.run_in_executor(None, _load_numpy) is None:
+                return None
+            effects = self.audio_effects.setdefault(guild_id, AudioEffects())
+            source = self.current_stream.get(guild_id, {}).get('source')
+            if source is not None:
+                source.effects = effects
+        return effects
+
+    def _play_source(self, guild_id: int, voice_client, source):
+        voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.song_finished_handler(guild_id, e)))
+        self.current_stream.setdefault(guild_id, {})['source'] = source
+
+    def _stop_current(self, guild_id: int, voice_client):
+        # Fim pedido pelo usuário: o song_finished_handler não deve tentar retomar.
+        self._manual_stops.add(guild_id)
+        if voice_client.source is not None:
+            voice_client.source.deliberate = True
+        voice_client.stop()
+
+    def playback_position(self, guild_id: int):
+        guild = self.bot.get_guild(guild_id)
+        source = guild.voice_client.source if guild and guild.voice_client else None
+        return getattr(source, 'position', None)
+
+    async def _refresh_current_stream(self, guild_id: int):
+        song = self.current_song_info.get(guild_id)
+        if not song:
+            return None
+        self.stream_cache.invalidate(song['webpage_url'])
+        info = await self._extract(song['webpage_url'], process_for_stream_url=True)
+        actual_info = info.get('entries', [info])[0] if info and info.get('entries') else info
+        if not actual_info or 'url' not in actual_info:
+            return None
+        if self.current_song_info.get(guild_id) is not song:
+            return None # A música mudou durante a extração: não sobrescreve o stream da nova
+        self._cache_stream_info(song['webpage_url'], actual_info)
+        stream = self.current_stream.setdefault(guild_id, {})
+        stream.update({'stream_url': actual_info['url'], 'stream_format': stream_format_of(actual_info), 'is_local_file': False})
+        return stream
+
+    async def restart_current_at(self, guild_id: int, position: float, refresh_stream: bool = False) -> bool:
+        # Reinicia o FFmpeg da música atual em `position` (seek ou retomada após falha).
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        stream = self.current_stream.get(guild_id)
+        song = self.current_song_info.get(guild_id)
+        if not vc or not vc.is_connected() or not song:
+            return False
+        generation = self._play_generation[guild_id]
+        # Stop/skip durante a extração ou a espera por um slot de FFmpeg: a música que pedimos já não é a atual.
+        changed = lambda: self._play_generation[guild_id] != generation or self.current_song_info.get(guild_id) is not song
+        if refresh_stream or not stream or not stream.get('stream_url'):
+            if stream and stream['is_local_file'] and os.path.exists(stream['stream_url']):
+                pass # Arquivo local não expira
+            else:
+                stream = await self._refresh_current_stream(guild_id)
+                if not stream or changed():
+                    return False
+
+        source = await self.ffmpeg_supervisor.spawn(guild_id, functools.partial(
+            self._create_audio_source, stream['stream_url'], stream['stream_format'], stream['is_local_file'], position,
+            effects=self.audio_effects.get(guild_id)))
+        if not vc.is_connected() or changed():
+            source.discard()
+            return False
+        if vc.is_playing() or vc.is_paused():
+            # Troca o source no player já existente: o `after` da música não dispara.
+            was_paused = vc.is_paused()
+            old_source = vc.source
+            vc.source = source
+            self.current_stream[guild_id]['source'] = source
+            if was_paused: vc.pause()
+            if old_source is not None and old_source is not source:
+                old_source.discard()
+        else:
+            self._play_source(guild_id, vc, source)
+        return True
+
+    async def _try_resume_after_failure(self, guild_id: int, finished_source) -> bool:
+        song = self.current_song_info.get(guild_id)
+        position = getattr(finished_source, 'position', None)
+        if not song or position is None:
+            return False
+        duration = song.get('duration')
+        try:
+            if not duration or position >= float(duration) - RESUME_MIN_REMAINING:
+                return False
+        except (ValueError, TypeError):
+            return False
+        attempts = self._resume_attempts.get(guild_id, 0) + 1
+        if attempts > RESUME_MAX_ATTEMPTS:
+            return False
+        self._resume_attempts[guild_id] = attempts
+        log.info("Stream interrompido em %s; retomando (tentativa %d).", format_timestamp(position), attempts,
+                 extra={'guild_id': guild_id})
+        # Reaproveita a URL atual se ela ainda vale (economiza uma extração); só renova se ela estiver perto de
+        # expirar ou se o source que caiu já era uma retomada nessa URL que não entregou nenhum frame.
+        stream = self.current_stream.get(guild_id) or {}
+        stream_url = stream.get('stream_url')
+        url_failed = getattr(finished_source, 'frames_read', 0) == 0
+        url_valid = bool(stream_url) and (stream.get('is_local_file') or self.stream_cache.expires_at(stream_url) > time.time())
+        try:
+            if url_valid and not url_failed:
+                return await self.restart_current_at(guild_id, position)
+            return await self.restart_current_at(guild_id, position, refresh_stream=True)
+        except Exception as e:
+            log.warning("Falha ao retomar música: %s", e, extra={'guild_id': guild_id})
+            return False
+
     async def song_finished_handler(self, guild_id: int, error=None):
         if error: 
-            print(f"Música finalizada com erro no servidor {guild_id}: {error}")
+            log.warning("Música finalizada com erro: %s", error, extra={'guild_id': guild_id})
         guild = self.bot.get_guild(guild_id)
         if guild and guild.voice_client and guild.voice_client.is_connected():
+            manual_stop = guild_id in self._manual_stops
+            self._manual_stops.discard(guild_id)
+            # Stream caiu antes do fim: retoma na mesma posição em vez de pular para a próxima.
+            finished_source = self.current_stream.get(guild_id, {}).get('source')
+            if not manual_stop and await self._try_resume_after_failure(guild_id, finished_source):
+                return
             await self.play_next_song(guild_id)
         else:
             await self.cleanup_player_state(guild_id, "Bot desconectado, parando reprodução.")
 
     async def cleanup_player_state(self, guild_id: int, cleanup_message: str = None):
+        self._play_generation[guild_id] += 1
+        self._start_requested.discard(guild_id)
         self.current_song_info.pop(guild_id, None)
         self.get_queue(guild_id).clear()
         self.prefetched_stream_info.pop(guild_id, None) 
+        self.current_stream.pop(guild_id, None)
+        self._resume_attempts.pop(guild_id, None)
+        self._manual_stops.discard(guild_id)
+        self.ffmpeg_supervisor.kill_guild(guild_id)
         
         player_msg = self.active_player_messages.pop(guild_id, None)
         if player_msg:
@@ -498,14 +1791,14 @@ class MusicCog(commands.Cog):
     async def stop_player_and_cleanup(self, guild_id: int, channel_for_message: discord.TextChannel = None, stop_reason: str = "Reprodução parada."):
         guild = self.bot.get_guild(guild_id)
         if not guild: 
-            print(f"Erro: Servidor {guild_id} não encontrado em stop.")
+            log.warning("Servidor não encontrado em stop.", extra={'guild_id': guild_id})
             return
 
         current_song = self.current_song_info.get(guild_id)
         if current_song: self.get_history(guild_id).append(current_song)
             
         vc = guild.voice_client
-        if vc and (vc.is_playing() or vc.is_paused()): vc.stop() 
+        if vc and (vc.is_playing() or vc.is_paused()): self._stop_current(guild_id, vc)
         
         self.get_queue(guild_id).clear()
         self.prefetched_stream_info.pop(guild_id, None)
@@ -516,16 +1809,17 @@ class MusicCog(commands.Cog):
     async def on_voice_state_update(self, member, before, after):
         if member.id == self.bot.user.id and before.channel is not None and after.channel is None:
             guild_id = before.channel.guild.id
-            print(f"Bot desconectado da guild {guild_id}. Limpando estado.")
+            log.info("Bot desconectado do canal de voz. Limpando estado.", extra={'guild_id': guild_id})
             current_song = self.current_song_info.get(guild_id)
             if current_song: self.get_history(guild_id).append(current_song)
             await self.cleanup_player_state(guild_id, "O bot foi desconectado do canal de voz.")
 
-    @commands.command(name="join", aliases=["connect"])
+    @commands.hybrid_command(name="join", aliases=["connect"], description="Conecta o bot ao seu canal de voz.")
     @commands.guild_only()
     async def join_command(self, ctx: commands.Context):
+        if ctx.interaction: await ctx.defer(ephemeral=True)
         if not ctx.author.voice or not ctx.author.voice.channel: 
-            return await ctx.send("Você não está em um canal de voz!", delete_after=20)
+            return await self._reply(ctx, "Você não está em um canal de voz!", delete_after=20)
         
         channel = ctx.author.voice.channel
         self.guild_music_channels[ctx.guild.id] = ctx.channel
@@ -533,47 +1827,61 @@ class MusicCog(commands.Cog):
         vc = ctx.guild.voice_client
         if vc and vc.is_connected():
             if vc.channel == channel: 
-                await ctx.send("Já estou neste canal.", delete_after=15)
+                await self._reply(ctx, "Já estou neste canal.", delete_after=15)
             else: 
                 try:
                     await vc.move_to(channel)
-                    await ctx.send(f"Movido para: **{channel.name}**")
+                    await self._reply(ctx, f"Movido para: **{channel.name}**")
                 except asyncio.TimeoutError:
-                    await ctx.send(f"Timeout ao mover para: **{channel.name}**.", delete_after=20)
+                    await self._reply(ctx, f"Timeout ao mover para: **{channel.name}**.", delete_after=20)
                 except Exception as e:
-                    await ctx.send(f"Erro ao mover: {e}", delete_after=20)
+                    await self._reply(ctx, f"Erro ao mover: {e}", delete_after=20)
         else: 
             try:
                 await channel.connect(timeout=10.0, reconnect=True)
-                await ctx.send(f"Conectado a: **{channel.name}**")
+                await self._reply(ctx, f"Conectado a: **{channel.name}**")
             except asyncio.TimeoutError:
-                await ctx.send(f"Timeout ao conectar em: **{channel.name}**. Verifique permissões.", delete_after=25)
+                await self._reply(ctx, f"Timeout ao conectar em: **{channel.name}**. Verifique permissões.", delete_after=25)
             except Exception as e:
-                await ctx.send(f"Erro ao conectar: {e}", delete_after=25)
+                await self._reply(ctx, f"Erro ao conectar: {e}", delete_after=25)
 
-    @commands.command(name="leave", aliases=["disconnect"])
+    @commands.hybrid_command(name="leave", aliases=["disconnect"], description="Desconecta o bot do canal de voz.")
     @commands.guild_only()
     async def leave_command(self, ctx: commands.Context):
         vc = ctx.guild.voice_client
         if vc and vc.is_connected():
+            if ctx.interaction: await ctx.defer(ephemeral=True)
             current_song = self.current_song_info.get(ctx.guild.id)
             if current_song: self.get_history(ctx.guild.id).append(current_song)
             await self.stop_player_and_cleanup(ctx.guild.id, ctx.channel, "Desconectado por comando.") 
             await vc.disconnect(force=False)
         else: 
-            await ctx.send("Não estou conectado a um canal de voz.", delete_after=20)
-        try: await ctx.message.delete()
-        except: pass
+            await self._reply(ctx, "Não estou conectado a um canal de voz.", delete_after=20)
+            return await self._acknowledge(ctx)
+        if ctx.interaction:
+            await self._reply(ctx, "Desconectado.")
+        else:
+            await self._acknowledge(ctx)
     
-    @commands.command(name="play", aliases=["p"])
-    @commands.guild_only()
-    async def play_command(self, ctx: commands.Context, *, query: str):
-        self.guild_music_channels[ctx.guild.id] = ctx.channel
-        try: await ctx.message.delete()
-        except: pass
+    async def _acknowledge(self, ctx: commands.Context, defer: bool = False):
+        # Prefixo: apaga a mensagem do comando. Slash: não há o que apagar; adia a resposta se o comando pode demorar.
+        if ctx.interaction is None:
+            try: await ctx.message.delete()
+            except: pass
+        elif defer and not ctx.interaction.response.is_done():
+            await ctx.defer(ephemeral=True)
+
+    async def _reply(self, ctx: commands.Context, content: str = None, *, delete_after: float = None, **kwargs):
+        # Respostas a slash commands são efêmeras (sem DELETE agendado); no prefixo mantém o delete_after.
+        if ctx.interaction is not None:
+            return await ctx.send(content, ephemeral=True, **kwargs)
+        return await ctx.send(content, delete_after=delete_after, **kwargs)
 
+    async def _ensure_voice(self, ctx: commands.Context):
+        # Conecta/move o bot para o canal do autor. Retorna None (já avisando no chat) se falhar.
         if not ctx.author.voice or not ctx.author.voice.channel:
-            return await ctx.send("Você precisa estar em um canal de voz.", delete_after=20)
+            await self._reply(ctx, "Você precisa estar em um canal de voz.", delete_after=20)
+            return None
 
         user_voice_channel = ctx.author.voice.channel
         vc = ctx.guild.voice_client 
@@ -582,22 +1890,95 @@ class MusicCog(commands.Cog):
             try: 
                 vc = await user_voice_channel.connect(timeout=10.0, reconnect=True) 
             except asyncio.TimeoutError:
-                return await ctx.send(f"Timeout ao conectar em: **{user_voice_channel.name}**.", delete_after=25)
+                await self._reply(ctx, f"Timeout ao conectar em: **{user_voice_channel.name}**.", delete_after=25)
+                return None
             except Exception as e:
-                return await ctx.send(f"Não consegui entrar no seu canal ({user_voice_channel.name}): {e}", delete_after=25)
+                await self._reply(ctx, f"Não consegui entrar no seu canal ({user_voice_channel.name}): {e}", delete_after=25)
+                return None
         elif vc.channel != user_voice_channel: 
             try: 
                 await vc.move_to(user_voice_channel) 
             except asyncio.TimeoutError:
-                 return await ctx.send(f"Timeout ao mover para: **{user_voice_channel.name}**.", delete_after=20)
+                await self._reply(ctx, f"Timeout ao mover para: **{user_voice_channel.name}**.", delete_after=20)
+                return None
             except Exception as e:
-                return await ctx.send(f"Não consegui me mover para seu canal ({user_voice_channel.name}): {e}", delete_after=25)
+                await self._reply(ctx, f"Não consegui me mover para seu canal ({user_voice_channel.name}): {e}", delete_after=25)
+                return None
         
         if not vc:
-            return await ctx.send("Erro crítico: Bot não conseguiu conectar à voz.", delete_after=20) 
-        
+            await self._reply(ctx, "Erro crítico: Bot não conseguiu conectar à voz.", delete_after=20) 
+        return vc
+
+    @commands.hybrid_command(name="play", aliases=["p"], description="Toca uma música ou playlist (busca, URL do YouTube ou SoundCloud).")
+    @commands.guild_only()
+    @app_commands.describe(query="Nome da música, URL ou playlist")
+    async def play_command(self, ctx: commands.Context, *, query: str):
+        self.guild_music_channels[ctx.guild.id] = ctx.channel
+        await self._acknowledge(ctx, defer=True)
+
+        # Fila cheia antes da admissão: um pedido recusado não gasta os tokens do usuário/servidor.
+        if len(self.get_queue(ctx.guild.id)) >= MAX_QUEUE_LENGTH:
+            return await self._reply(ctx, f"A fila já tem o máximo de {MAX_QUEUE_LENGTH} músicas.", delete_after=20)
+        admission = await self._admit_extraction_request(ctx)
+        if not admission:
+            return
+
+        vc = await self._ensure_voice(ctx)
+        if not vc:
+            return
+
+        # Extrações interativas no limite ou limite global esgotado: responde na hora e resolve em segundo plano.
+        if admission == AdmissionController.BUSY or self._interactive_extractions >= INTERACTIVE_EXTRACTION_LIMIT:
+            return await self._defer_resolution(ctx, query, needs_global=admission == AdmissionController.BUSY)
+        await self._resolve_and_enqueue(ctx, query)
+
+    async def _admit_extraction_request(self, ctx: commands.Context):
+        # Retorna a decisão do AdmissionController, ou None (já avisando o usuário) se o pedido foi recusado.
+        decision, retry_after = self.admission.admit(ctx.author.id, ctx.guild.id)
+        if decision == AdmissionController.USER_LIMITED:
+            await self._reply(ctx, f"Calma! Você está pedindo músicas rápido demais. Tente de novo em {retry_after:.0f}s.", delete_after=15)
+            return None
+        if decision == AdmissionController.GUILD_LIMITED:
+            await self._reply(ctx, f"Muitos pedidos neste servidor agora. Tente de novo em {retry_after:.0f}s.", delete_after=15)
+            return None
+        return decision
+
+    async def _defer_resolution(self, ctx: commands.Context, query: str, needs_global: bool):
+        # needs_global: o admit() deu BUSY e o token global ainda não foi pago (ADMITTED já pagou).
+        try:
+            self._pending_resolutions.put_nowait((ctx, query, needs_global))
+        except asyncio.QueueFull:
+            return await self._reply(ctx, "O bot está muito ocupado agora. Tente de novo em instantes.", delete_after=20)
+        self._ensure_resolution_workers()
+        await self._reply(ctx, f"⏳ Muitos pedidos no momento: '{query}' entrou na fila de resolução "
+                               f"(posição {self._pending_resolutions.qsize()}).", delete_after=20)
+
+    def _ensure_resolution_workers(self):
+        self._resolution_workers = [w for w in self._resolution_workers if not w.done()]
+        while len(self._resolution_workers) < RESOLUTION_WORKERS:
+            self._resolution_workers.append(self.bot.loop.create_task(self._resolution_worker()))
+
+    async def _resolution_worker(self):
+        while True:
+            ctx, query, needs_global = await self._pending_resolutions.get()
+            try:
+                if needs_global:
+                    await self.admission.wait_global()
+                vc = ctx.guild.voice_client
+                if not vc or not vc.is_connected():
+                    continue # Bot saiu do canal enquanto o pedido esperava
+                await self._resolve_and_enqueue(ctx, query, show_typing=False)
+            except Exception as e:
+                log.warning("Erro ao resolver pedido pendente: %s", e, extra={'guild_id': ctx.guild.id, 'query': query})
+            finally:
+                self._pending_resolutions.task_done()
+
+    async def _resolve_and_enqueue(self, ctx: commands.Context, query: str, show_typing: bool = True):
+        vc = ctx.guild.voice_client
+        if not vc:
+            return
         queue = self.get_queue(ctx.guild.id)
-        is_starting_playback = not (vc.is_playing() or vc.is_paused())
+        is_starting_playback = not (vc.is_playing() or vc.is_paused() or ctx.guild.id in self._starting_playback)
         
         info = None
         is_yt_link = "youtube.com/" in query.lower() or \
@@ -609,44 +1990,58 @@ class MusicCog(commands.Cog):
         # >>> OTIMIZAÇÃO: Se for a primeira música (single) a tocar, tenta pegar o stream URL direto <<<
         process_for_stream_now = is_starting_playback and not is_direct_playlist_url
 
-        async with ctx.typing():
-            try:
-                info = await self.bot.loop.run_in_executor(None, 
-                    functools.partial(self._blocking_extract_info, query, 
-                                      is_soundcloud_search=False, 
-                                      process_for_stream_url=process_for_stream_now, # Passa True se for otimizar
-                                      process_playlist=is_direct_playlist_url))
-            except AgeRestrictionError as are:
-                is_general_search_or_youtube_single = not is_direct_playlist_url and \
-                                                     (is_yt_link or not "soundcloud.com" in query.lower())
-                if is_general_search_or_youtube_single: 
-                    await ctx.send(f"Conteúdo YT restrito. Tentando SC para '{are.original_query}'...", delete_after=20)
-                    try:
-                        # Para fallback, nunca pegamos stream URL direto, apenas metadados
-                        info = await self.bot.loop.run_in_executor(None, 
-                            functools.partial(self._blocking_extract_info, are.original_query, 
-                                              is_soundcloud_search=True, 
-                                              process_for_stream_url=False, # Apenas metadados no fallback
-                                              process_playlist=False))
-                    except Exception as e_sc:
-                        await ctx.send(f"Erro ao buscar '{are.original_query}' no SC: {e_sc}", delete_after=25)
-                        return 
-                else:
-                    await ctx.send(f"Conteúdo ({'playlist' if is_direct_playlist_url else 'link'}) restrito.", delete_after=25)
+        remaining_capacity = MAX_QUEUE_LENGTH - len(queue)
+        if remaining_capacity <= 0:
+            return await self._reply(ctx, f"A fila já tem o máximo de {MAX_QUEUE_LENGTH} músicas.", delete_after=20)
+
+        # URL de vídeo já no cache (aquecedor, prefetch ou play anterior): monta a entrada sem chamar o yt-dlp.
+        cache_key = None if is_direct_playlist_url else canonical_video_url(query)
+        cached = self.stream_cache.get(cache_key) if cache_key else None
+        if cached and cached.get('title'):
+            info = {'webpage_url': cached['webpage_url'], 'title': cached['title'], 'duration': cached.get('duration'),
+                    'url': cached['stream_url'], **(cached.get('stream_format') or {})}
+        else:
+            async with (ctx.typing(ephemeral=True) if show_typing else contextlib.nullcontext()):
+                try:
+                    info = await self._extract(query, 
+                                               is_soundcloud_search=False, 
+                                               process_for_stream_url=process_for_stream_now, # Passa True se for otimizar
+                                               process_playlist=is_direct_playlist_url,
+                                               playlist_items_to_extract=f"1-{remaining_capacity}" if is_direct_playlist_url else None)
+                except AgeRestrictionError as are:
+                    is_general_search_or_youtube_single = not is_direct_playlist_url and \
+                                                         (is_yt_link or not "soundcloud.com" in query.lower())
+                    if is_general_search_or_youtube_single: 
+                        await self._reply(ctx, f"Conteúdo YT restrito. Tentando SC para '{are.original_query}'...", delete_after=20)
+                        try:
+                            # Para fallback, nunca pegamos stream URL direto, apenas metadados
+                            info = await self._extract(are.original_query, 
+                                                       is_soundcloud_search=True, 
+                                                       process_for_stream_url=False, # Apenas metadados no fallback
+                                                       process_playlist=False)
+                        except Exception as e_sc:
+                            await self._reply(ctx, f"Erro ao buscar '{are.original_query}' no SC: {e_sc}", delete_after=25)
+                            return 
+                    else:
+                        await self._reply(ctx, f"Conteúdo ({'playlist' if is_direct_playlist_url else 'link'}) restrito.", delete_after=25)
+                        return
+                except Exception as e: 
+                    log.warning("Erro ao buscar música: %s", e, extra={'guild_id': ctx.guild.id, 'query': query})
+                    await self._reply(ctx, f"Erro ao buscar '{query}': {e}", delete_after=25)
                     return
-            except Exception as e: 
-                await ctx.send(f"Erro ao buscar '{query}': {e}", delete_after=25)
-                return
 
         if not info: 
-            return await ctx.send(f"Não encontrei nada para: '{query}'", delete_after=20)
+            return await self._reply(ctx, f"Não encontrei nada para: '{query}'", delete_after=20)
 
         songs_added_count = 0
         if info.get('_type') == 'playlist' and 'entries' in info: 
             playlist_title = info.get('title', 'Playlist Desconhecida')
             skipped_count = 0
+            truncated_count = 0
             for entry in info.get('entries', []): 
-                if entry and entry.get('webpage_url'):
+                if len(queue) >= MAX_QUEUE_LENGTH:
+                    truncated_count += 1
+                elif entry and entry.get('webpage_url'):
                     song_data = {
                         'webpage_url': entry['webpage_url'], 
                         'title': entry.get('title', 'Título Desconhecido'), 
@@ -661,13 +2056,14 @@ class MusicCog(commands.Cog):
             if songs_added_count > 0:
                 msg_playlist = f"Playlist **'{playlist_title}'** ({songs_added_count} músicas) adicionada por {ctx.author.mention}!"
                 if skipped_count > 0: msg_playlist += f" ({skipped_count} inválidas puladas)."
-                await ctx.send(msg_playlist, delete_after=30)
+                if truncated_count > 0: msg_playlist += f" ({truncated_count} não couberam: limite de {MAX_QUEUE_LENGTH} na fila)."
+                await self._reply(ctx, msg_playlist, delete_after=30)
             else:
-                await ctx.send(f"Não carreguei músicas da playlist '{playlist_title}'.", delete_after=20)
+                await self._reply(ctx, f"Não carreguei músicas da playlist '{playlist_title}'.", delete_after=20)
         else: 
             song_info_entry = info.get('entries', [info])[0] if info.get('entries') else info
             if not song_info_entry or not song_info_entry.get('webpage_url'):
-                return await ctx.send(f"Não obtive informações válidas para '{query}'.", delete_after=20)
+                return await self._reply(ctx, f"Não obtive informações válidas para '{query}'.", delete_after=20)
 
             song_data = {
                 'webpage_url': song_info_entry['webpage_url'], 
@@ -675,13 +2071,17 @@ class MusicCog(commands.Cog):
                 'requester': ctx.author.mention, 
                 'duration': song_info_entry.get('duration'),
                 # >>> OTIMIZAÇÃO: Armazena stream_url se foi obtido <<<
-                'stream_url': song_info_entry.get('url') if process_for_stream_now else None
+                'stream_url': song_info_entry.get('url') if process_for_stream_now else None,
+                'stream_format': stream_format_of(song_info_entry) if process_for_stream_now else None
             }
+            if process_for_stream_now:
+                self._cache_stream_info(song_data['webpage_url'], song_info_entry)
             queue.append(song_data)
             songs_added_count = 1
-            await ctx.send(f"Adicionado: **{song_data['title']}** por {ctx.author.mention}", delete_after=20)
+            await self._reply(ctx, f"Adicionado: **{song_data['title']}** por {ctx.author.mention}", delete_after=20)
 
-        if songs_added_count > 0 and is_starting_playback:
+        # Reavalia depois das esperas: outro pedido pode ter iniciado a reprodução enquanto este era extraído.
+        if songs_added_count > 0 and not (vc.is_playing() or vc.is_paused()):
             await self.play_next_song(ctx.guild.id)
         elif songs_added_count > 0 and queue:
             current_prefetch = self.prefetched_stream_info.get(ctx.guild.id)
@@ -694,59 +2094,137 @@ class MusicCog(commands.Cog):
     # Esses comandos permanecem os mesmos da versão anterior otimizada.
     # Vou colar eles aqui para completude, sem alterações significativas neles.
 
-    @commands.command(name="skip", aliases=["s"])
+    @play_command.autocomplete('query')
+    async def play_query_autocomplete(self, interaction: discord.Interaction, current: str):
+        # Sugestões só do cache local (histórico + URLs resolvidas): nenhuma chamada ao yt-dlp.
+        if not interaction.guild_id:
+            return []
+        current = current.strip()
+        suggestions = {}
+        for entry in await self.play_history.search_titles(interaction.guild_id, current, limit=25):
+            suggestions.setdefault(entry['webpage_url'], entry['title'])
+        if len(suggestions) < 25 and current:
+            for entry in self.stream_cache.search(current, limit=25 - len(suggestions)):
+                suggestions.setdefault(entry['webpage_url'], entry['title'])
+        return [app_commands.Choice(name=(title or url)[:100], value=url if len(url) <= 100 else (title or url)[:100])
+                for url, title in list(suggestions.items())[:25]]
+
+    @commands.hybrid_command(name="skip", aliases=["s"], description="Pula a música atual.")
     @commands.guild_only()
     async def skip_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
         vc = ctx.guild.voice_client
         if vc and (vc.is_playing() or vc.is_paused()):
             self.prefetched_stream_info.pop(ctx.guild.id, None)
-            vc.stop()
-            await ctx.send("Música pulada!", delete_after=15)
+            self._stop_current(ctx.guild.id, vc)
+            await self._reply(ctx, "Música pulada!", delete_after=15)
         else: 
-            await ctx.send("Nada tocando para pular.", delete_after=15)
+            await self._reply(ctx, "Nada tocando para pular.", delete_after=15)
 
-    @commands.command(name="stop")
+    @commands.hybrid_command(name="stop", description="Para a música e limpa a fila.")
     @commands.guild_only()
     async def stop_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
         await self.stop_player_and_cleanup(ctx.guild.id, ctx.channel, "Reprodução parada.")
 
-    @commands.command(name="pause")
+    @commands.hybrid_command(name="seek", description="Vai para um ponto da música atual (ex: 1:30).")
+    @commands.guild_only()
+    @app_commands.describe(tempo="Posição: segundos, mm:ss ou hh:mm:ss")
+    async def seek_command(self, ctx: commands.Context, tempo: str):
+        await self._acknowledge(ctx, defer=True)
+        guild_id = ctx.guild.id
+        vc = ctx.guild.voice_client
+        current = self.current_song_info.get(guild_id)
+        if not vc or not current or not (vc.is_playing() or vc.is_paused()):
+            return await self._reply(ctx, "Nada tocando para avançar/voltar.", delete_after=15)
+        try:
+            position = parse_timestamp(tempo)
+        except ValueError:
+            return await self._reply(ctx, f"Tempo inválido: `{tempo}`. Use segundos, mm:ss ou hh:mm:ss.", delete_after=20)
+        duration = current.get('duration')
+        if duration and position >= float(duration):
+            return await self._reply(ctx, f"A música tem só {format_timestamp(duration)}.", delete_after=20)
+        try:
+            restarted = await self.restart_current_at(guild_id, position)
+        except Exception as e:
+            return await self._reply(ctx, f"Erro ao mudar a posição: {e}", delete_after=20)
+        if restarted:
+            await self._reply(ctx, f"⏩ Indo para {format_timestamp(position)}.", delete_after=15)
+        else:
+            await self._reply(ctx, "Não foi possível mudar a posição da música.", delete_after=20)
+
+    @commands.hybrid_command(name="volume", aliases=["vol"], description="Mostra ou ajusta o volume (0-200%).")
+    @commands.guild_only()
+    @app_commands.describe(nivel="Volume em %")
+    async def volume_command(self, ctx: commands.Context, nivel: int = None):
+        await self._acknowledge(ctx)
+        effects = await self._effects_for(ctx.guild.id)
+        if effects is None:
+            return await self._reply(ctx, "Efeitos indisponíveis: NumPy não está instalado.", delete_after=20)
+        if nivel is None:
+            return await self._reply(ctx, f"🔊 Volume atual: {round(effects.volume * 100)}%.", delete_after=15)
+        if not 0 <= nivel <= VOLUME_MAX:
+            return await self._reply(ctx, f"Volume deve ficar entre 0 e {VOLUME_MAX}%.", delete_after=15)
+        effects.volume = nivel / 100
+        await self._reply(ctx, f"🔊 Volume: {nivel}%.", delete_after=15)
+
+    @commands.hybrid_command(name="bass", aliases=["bassboost"], description="Reforça os graves (nível 0 a 3).")
+    @commands.guild_only()
+    @app_commands.describe(nivel="0 desliga; 1 a 3 aumentam os graves")
+    async def bass_command(self, ctx: commands.Context, nivel: int = None):
+        await self._acknowledge(ctx)
+        effects = await self._effects_for(ctx.guild.id)
+        if effects is None:
+            return await self._reply(ctx, "Efeitos indisponíveis: NumPy não está instalado.", delete_after=20)
+        max_level = len(BASS_BOOST_LEVELS) - 1
+        if nivel is None:
+            nivel = 0 if effects.bass_level else 2 # Sem argumento: alterna entre desligado e médio
+        if not 0 <= nivel <= max_level:
+            return await self._reply(ctx, f"Nível de graves deve ficar entre 0 e {max_level}.", delete_after=15)
+        effects.bass_level = nivel
+        await self._reply(ctx, f"🎚️ Graves: {'nível ' + str(nivel) if nivel else 'normais'}.", delete_after=15)
+
+    @commands.hybrid_command(name="normalize", aliases=["norm"], description="Liga/desliga a normalização de volume entre músicas.")
+    @commands.guild_only()
+    @app_commands.describe(ligar="Omitido: alterna o estado atual")
+    async def normalize_command(self, ctx: commands.Context, ligar: bool = None):
+        await self._acknowledge(ctx)
+        effects = await self._effects_for(ctx.guild.id)
+        if effects is None:
+            return await self._reply(ctx, "Efeitos indisponíveis: NumPy não está instalado.", delete_after=20)
+        effects.normalize = (not effects.normalize) if ligar is None else ligar
+        await self._reply(ctx, f"📏 Normalização {'ligada' if effects.normalize else 'desligada'}. ({effects.describe()})", delete_after=15)
+
+    @commands.hybrid_command(name="pause", description="Pausa a música atual.")
     @commands.guild_only()
     async def pause_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
         vc = ctx.guild.voice_client
         if vc and vc.is_playing():
             vc.pause()
             current_song = self.current_song_info.get(ctx.guild.id)
             if current_song: await self._update_player_message(ctx.guild.id, current_song, is_paused=True)
-            await ctx.send("Música pausada.", delete_after=15)
+            await self._reply(ctx, "Música pausada.", delete_after=15)
         else: 
-            await ctx.send("Nada tocando ou já pausado.", delete_after=15)
+            await self._reply(ctx, "Nada tocando ou já pausado.", delete_after=15)
 
-    @commands.command(name="resume", aliases=["unpause"])
+    @commands.hybrid_command(name="resume", aliases=["unpause"], description="Retoma a música pausada.")
     @commands.guild_only()
     async def resume_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
         vc = ctx.guild.voice_client
         if vc and vc.is_paused():
             vc.resume()
             current_song = self.current_song_info.get(ctx.guild.id)
             if current_song: await self._update_player_message(ctx.guild.id, current_song, is_paused=False)
-            await ctx.send("Música retomada.", delete_after=15)
+            await self._reply(ctx, "Música retomada.", delete_after=15)
         else: 
-            await ctx.send("Nenhuma música pausada.", delete_after=15)
+            await self._reply(ctx, "Nenhuma música pausada.", delete_after=15)
 
-    @commands.command(name="queue", aliases=["q", "list"])
+    @commands.hybrid_command(name="queue", aliases=["q", "list"], description="Mostra a fila de músicas.")
     @commands.guild_only()
     async def queue_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
 
         guild_id = ctx.guild.id
         queue = self.get_queue(guild_id)
@@ -765,6 +2243,10 @@ class MusicCog(commands.Cog):
                     duration_str = f" ({m:02d}:{s:02d})"
                     if h > 0: duration_str = f" ({h:02d}:{m:02d}:{s:02d})"
                 except (ValueError, TypeError): pass
+            position = self.playback_position(guild_id)
+            if position is not None:
+                # Relógio de reprodução: "(01:23 / 03:45)", ou só a posição se a duração for desconhecida.
+                duration_str = f" ({format_timestamp(position)} / {duration_str.strip(' ()')})" if duration_str else f" ({format_timestamp(position)})"
             embed.add_field(name=f"💿 Tocando Agora{status}", 
                             value=f"[{current.get('title','N/A')}]({current.get('webpage_url','#')}){duration_str}\n(Por: {current.get('requester','N/A')})", 
                             inline=False)
@@ -791,83 +2273,206 @@ class MusicCog(commands.Cog):
             embed.add_field(name=f"🎶 Próximas ({len(queue)} total)", value="\n".join(q_list_str) or "Nenhuma", inline=False)
             if len(queue) > limit: embed.set_footer(text=f"... e mais {len(queue) - limit} música(s).")
         
-        await ctx.send(embed=embed, delete_after=60)
+        await self._reply(ctx, embed=embed, delete_after=60)
 
-    @commands.command(name="clearqueue", aliases=["cq", "clear"])
+    @commands.hybrid_command(name="clearqueue", aliases=["cq", "clear"], description="Limpa todas as músicas da fila.")
     @commands.guild_only()
     async def clear_queue_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
+        await self._acknowledge(ctx)
         queue = self.get_queue(ctx.guild.id)
         if not queue: msg_text = "A fila já está vazia."
         else:
             queue.clear()
             self.prefetched_stream_info.pop(ctx.guild.id, None)
             msg_text = "Fila de músicas limpa!"
-        await ctx.send(msg_text, delete_after=20)
+        await self._reply(ctx, msg_text, delete_after=20)
 
-    @commands.command(name="history", aliases=["hist"])
+    @commands.hybrid_command(name="history", aliases=["hist"], description="Mostra as últimas músicas tocadas.")
     @commands.guild_only()
-    async def history_command(self, ctx: commands.Context):
-        try: await ctx.message.delete()
-        except: pass
-        history = self.get_history(ctx.guild.id)
+    async def history_command(self, ctx: commands.Context, quantidade: int = 10):
+        await self._acknowledge(ctx)
+        quantidade = max(1, min(quantidade, 25))
+        history = await self.play_history.recent(ctx.guild.id, quantidade)
         if not history:
-            return await ctx.send("Nenhuma música no histórico recente.", delete_after=20)
-        embed = discord.Embed(title=f"📜 Histórico Recente (Últimas {history.maxlen})", color=discord.Color.light_grey())
-        history_list = [f"{i+1}. [{s.get('title','N/A')}]({s.get('webpage_url','#')}) (Por: {s.get('requester','N/A')})"
-                        for i, s in enumerate(reversed(list(history)))]
+            return await self._reply(ctx, "Nenhuma música no histórico recente.", delete_after=20)
+        embed = discord.Embed(title=f"📜 Histórico Recente (Últimas {len(history)})", color=discord.Color.light_grey())
+        history_list = [f"{i+1}. [{s.get('title') or 'N/A'}]({s.get('webpage_url','#')}) (Por: {s.get('requester') or 'N/A'})"
+                        for i, s in enumerate(history)]
         embed.description = "\n".join(history_list)
-        await ctx.send(embed=embed, delete_after=60)
+        await self._reply(ctx, embed=embed, delete_after=60)
+
+    @commands.hybrid_command(name="top", description="Mostra as músicas mais tocadas no servidor.")
+    @commands.guild_only()
+    async def top_command(self, ctx: commands.Context, dias: int = 7):
+        await self._acknowledge(ctx)
+        dias = max(1, min(dias, 365))
+        top = await self.play_history.top_tracks(ctx.guild.id, days=dias, limit=10)
+        if not top:
+            return await self._reply(ctx, f"Nenhuma música tocada nos últimos {dias} dia(s).", delete_after=20)
+        embed = discord.Embed(title=f"🏆 Mais Tocadas (Últimos {dias} dias)", color=discord.Color.gold())
+        embed.description = "\n".join(f"{i+1}. [{t.get('title') or 'N/A'}]({t['webpage_url']}) — {t['plays']}x"
+                                      for i, t in enumerate(top))
+        await self._reply(ctx, embed=embed, delete_after=60)
+
+    @commands.hybrid_command(name="replay", description="Coloca de volta na fila as últimas músicas tocadas.")
+    @commands.guild_only()
+    async def replay_command(self, ctx: commands.Context, quantidade: int = 1):
+        self.guild_music_channels[ctx.guild.id] = ctx.channel
+        await self._acknowledge(ctx, defer=True)
+        if len(self.get_queue(ctx.guild.id)) >= MAX_QUEUE_LENGTH:
+            return await self._reply(ctx, f"A fila já tem o máximo de {MAX_QUEUE_LENGTH} músicas.", delete_after=20)
+        quantidade = max(1, min(quantidade, 50, MAX_QUEUE_LENGTH - len(self.get_queue(ctx.guild.id))))
+        if not await self._admit_extraction_request(ctx):
+            return
+        recent = await self.play_history.recent(ctx.guild.id, quantidade)
+        if not recent:
+            return await self._reply(ctx, "Nenhuma música no histórico para repetir.", delete_after=20)
+
+        vc = await self._ensure_voice(ctx)
+        if not vc:
+            return
+
+        queue = self.get_queue(ctx.guild.id)
+        for entry in reversed(recent): # Mantém a ordem original de reprodução
+            queue.append({
+                'webpage_url': entry['webpage_url'],
+                'title': entry.get('title') or 'Título Desconhecido',
+                'requester': ctx.author.mention,
+                'duration': entry.get('duration'),
+                'stream_url': None
+            })
+        await self._reply(ctx, f"{len(recent)} música(s) do histórico adicionada(s) por {ctx.author.mention}!", delete_after=20)
+
+        if not (vc.is_playing() or vc.is_paused()): # Reavaliado: o _reply acima cede o loop
+            await self.play_next_song(ctx.guild.id)
+        else:
+            self.bot.loop.create_task(self._prefetch_next_song_url(ctx.guild.id))
+
+    @commands.command(name="audiostats")
+    @commands.is_owner()
+    async def audio_stats_command(self, ctx: commands.Context):
+        await self._acknowledge(ctx)
+        embed = discord.Embed(title="🎛️ Perfis do FFmpeg", color=discord.Color.dark_teal())
+        supervisor = self.ffmpeg_supervisor
+        processes = supervisor.process_stats()
+        total_cpu = sum(p['cpu_percent'] or 0 for p in processes)
+        total_rss = sum(p['rss_mb'] or 0 for p in processes)
+        embed.description = (f"Processos: {len(processes)}/{supervisor.max_processes} • na fila: {supervisor.waiting} • "
+                             f"iniciados: {supervisor.spawned_total} • órfãos encerrados: {supervisor.orphans_killed}\n"
+                             f"CPU total: {total_cpu:.1f}% • RSS total: {total_rss:.1f} MB")
+        top_processes = sorted(processes, key=lambda p: p['cpu_percent'] or 0, reverse=True)[:5]
+        if top_processes:
+            embed.add_field(name="Maiores consumidores", inline=False, value="\n".join(
+                f"pid {p['pid']} • servidor {p['guild_id']} • {p['profile']} • "
+                f"{(p['cpu_percent'] or 0):.1f}% CPU • {(p['rss_mb'] or 0):.1f} MB • {p['age']:.0f}s"
+                for p in top_processes))
+        rows = self.ffmpeg_profile_stats.summary()
+        for row in rows[:20]:
+            median = f"{row['median_startup'] * 1000:.0f} ms" if row['median_startup'] is not None else "N/A"
+            embed.add_field(name=f"{row['profile']} ({row['variant']})",
+                            value=f"{row['plays']} reproduções • {row['failures']} falhas • {row['reconnects']} reconexões • início {median}",
+                            inline=False)
+        await self._reply(ctx, embed=embed, delete_after=60)
 
     async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
-        try: 
-            if ctx.message: await ctx.message.delete()
-        except: pass 
+        await self._acknowledge(ctx)
         
         if isinstance(error, commands.CommandNotFound): return
+        if isinstance(error, commands.HybridCommandError):
+            error = error.original
         
-        error_map = {
-            commands.MissingRequiredArgument: f"Falta argumento: `{error.param.name}`. Use `{COMMAND_PREFIX}help {ctx.command.name}`.",
-            commands.NoPrivateMessage: "Este comando não pode ser usado em DMs.",
-            commands.CommandOnCooldown: f"Comando em cooldown. Tente em {error.retry_after:.1f}s.",
-            commands.NotOwner: "Você não tem permissão para usar este comando.",
-            commands.MissingPermissions: f"Você não tem as permissões necessárias: {', '.join(error.missing_permissions)}",
-            commands.BotMissingPermissions: f"Eu não tenho as permissões necessárias: {', '.join(error.missing_permissions)}",
-            commands.GuildNotFound: f"Servidor não encontrado: {error.argument}"
-        }
-        error_message_content = error_map.get(type(error), f"Erro no comando `{ctx.command.name}`: {str(error)[:1000]}")
-        
-        if not error_map.get(type(error)):
-             print(f"Erro Detalhado (Guild: {ctx.guild.id if ctx.guild else 'DM'}, Cmd: {ctx.command.name if ctx.command else 'N/A'}): {error}")
+        command_name = ctx.command.name if ctx.command else None
+        # Cada mensagem só é montada para o tipo que casou: param, retry_after etc. só existem nele.
+        error_messages = (
+            (commands.MissingRequiredArgument, lambda e: f"Falta argumento: `{e.param.name}`. Use `{COMMAND_PREFIX}help {command_name}`."),
+            (commands.NoPrivateMessage, lambda e: "Este comando não pode ser usado em DMs."),
+            (commands.CommandOnCooldown, lambda e: f"Comando em cooldown. Tente em {e.retry_after:.1f}s."),
+            (commands.NotOwner, lambda e: "Você não tem permissão para usar este comando."),
+            (commands.MissingPermissions, lambda e: f"Você não tem as permissões necessárias: {', '.join(e.missing_permissions)}"),
+            (commands.BotMissingPermissions, lambda e: f"Eu não tenho as permissões necessárias: {', '.join(e.missing_permissions)}"),
+            (commands.GuildNotFound, lambda e: f"Servidor não encontrado: {e.argument}"),
+        )
+        build_message = next((build for error_type, build in error_messages if isinstance(error, error_type)), None)
+        if build_message:
+            error_message_content = build_message(error)
+        else:
+            error_message_content = f"Erro no comando `{command_name}`: {str(error)[:1000]}"
+            log.error("Erro no comando: %s", error, exc_info=error,
+                      extra={'guild_id': ctx.guild.id if ctx.guild else None, 'command': command_name})
 
         try: 
-            await ctx.send(error_message_content, delete_after=25)
+            await self._reply(ctx, error_message_content, delete_after=25)
         except discord.Forbidden:
-            print(f"Sem permissão para enviar msg de erro em {ctx.channel.id} (Guild: {ctx.guild.id})")
+            log.warning("Sem permissão para enviar msg de erro no canal %s.", ctx.channel.id, extra={'guild_id': ctx.guild.id})
         except Exception as e: 
-            print(f"Erro ao enviar mensagem de erro genérica: {e}")
+            log.warning("Erro ao enviar mensagem de erro genérica: %s", e, extra={'guild_id': ctx.guild.id if ctx.guild else None})
         
 async def setup(bot: commands.Bot):
     await bot.add_cog(MusicCog(bot))
-    print("MusicCog (otimizado para início rápido) carregado.")
-
-async def main():
+    _mark_startup('cog_loaded')
+    log.info("MusicCog (otimizado para início rápido) carregado.")
+
+def print_startup_report():
+    print("--- Tempos de inicialização (s desde o início do processo) ---")
+    for phase in ('module_loaded', 'cog_loaded', 'gateway_ready', 'yt_dlp_ready'):
+        value = STARTUP_TIMINGS.get(phase)
+        print(f"{phase:>14}: {value:.3f}" if value is not None else f"{phase:>14}: -")
+    ready = [STARTUP_TIMINGS[p] for p in ('gateway_ready', 'yt_dlp_ready') if p in STARTUP_TIMINGS]
+    if len(ready) == 2:
+        print(f"{'pronto':>14}: {max(ready):.3f}")
+
+async def benchmark_startup_offline():
+    # Sem token: mede só o que não depende do Discord (import do módulo, setup do cog e carregamento do yt-dlp).
+    # O setup() roda num commands.Bot de verdade, sem login, exatamente como em main().
+    bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=discord.Intents.default(), help_command=None)
+    async with bot:
+        await setup(bot)
+        music_cog = bot.get_cog("MusicCog")
+        if music_cog._ytdlp_preload:
+            await music_cog._ytdlp_preload
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, _load_ytdlp)
+        await bot.remove_cog("MusicCog")
+    print("DISCORD_BOT_TOKEN ausente: fase do gateway não medida.")
+    print_startup_report()
+
+async def main(benchmark_startup=False):
+    if benchmark_startup and not TOKEN:
+        return await benchmark_startup_offline()
+    if not TOKEN:
+        raise ValueError("Token do Discord não encontrado na variável de ambiente DISCORD_BOT_TOKEN")  # IMPORTANTE: Substitua e use variáveis de ambiente!
+    log_listener = setup_logging()
     intents = discord.Intents.default()
-    intents.message_content = True
+    intents.message_content = ENABLE_PREFIX_COMMANDS
     intents.voice_states = True
-    bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents, help_command=None)
+    # Sem prefixo, comandos de texto só funcionam mencionando o bot (não exige message_content).
+    command_prefix = COMMAND_PREFIX if ENABLE_PREFIX_COMMANDS else commands.when_mentioned
+    bot = commands.Bot(command_prefix=command_prefix, intents=intents, help_command=None)
+
+    async def sync_app_commands():
+        if SYNC_APP_COMMANDS:
+            synced = await bot.tree.sync()
+            log.info("%d slash command(s) sincronizado(s).", len(synced))
+    bot.setup_hook = sync_app_commands
     
     @bot.event
     async def on_ready():
-        print(f'Bot {bot.user.name} (ID: {bot.user.id}) online!')
-        print(f"Conectado a {len(bot.guilds)} servidor(es).")
-        await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=f"{COMMAND_PREFIX}play | {COMMAND_PREFIX}help"))
+        log.info("Bot %s (ID: %s) online! Conectado a %d servidor(es).", bot.user.name, bot.user.id, len(bot.guilds))
+        activity_name = f"{COMMAND_PREFIX}play | {COMMAND_PREFIX}help" if ENABLE_PREFIX_COMMANDS else "/play | /help"
+        await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=activity_name))
+        _mark_startup('gateway_ready')
+        if benchmark_startup:
+            music_cog = bot.get_cog("MusicCog")
+            if music_cog and music_cog._ytdlp_preload:
+                await music_cog._ytdlp_preload
+            print_startup_report()
+            await bot.close()
     
-    @bot.command(name="help")
+    @bot.hybrid_command(name="help", description="Mostra os comandos do bot.")
     async def help_command_custom(ctx: commands.Context, *, command_name: str = None):
-        try: await ctx.message.delete()
-        except: pass
+        if ctx.interaction is None:
+            try: await ctx.message.delete()
+            except: pass
         embed = discord.Embed(title="🎧 Ajuda - Bot de Música 🎧", color=discord.Color.green())
         
         if command_name:
@@ -886,27 +2491,48 @@ async def main():
             # ... (demais campos do help) ...
             embed.add_field(name=f"`{COMMAND_PREFIX}stop`", value="Para a música e limpa a fila.", inline=False)
             embed.add_field(name=f"`{COMMAND_PREFIX}pause` / `{COMMAND_PREFIX}resume`", value="Pausa ou retoma a música atual.", inline=False)
+            embed.add_field(name=f"`{COMMAND_PREFIX}seek <tempo>`", value="Vai para um ponto da música atual (ex: `90`, `1:30`).", inline=False)
+            embed.add_field(name=f"`{COMMAND_PREFIX}volume [0-{VOLUME_MAX}]`, `{COMMAND_PREFIX}bass [0-3]`, `{COMMAND_PREFIX}normalize`", value="Volume, reforço de graves e normalização; valem na hora, sem reiniciar a música.", inline=False)
             embed.add_field(name=f"`{COMMAND_PREFIX}queue`, `{COMMAND_PREFIX}q`", value="Mostra a fila de músicas.", inline=False)
             embed.add_field(name=f"`{COMMAND_PREFIX}clearqueue`, `{COMMAND_PREFIX}cq`", value="Limpa todas as músicas da fila.", inline=False)
-            embed.add_field(name=f"`{COMMAND_PREFIX}history`, `{COMMAND_PREFIX}hist`", value="Mostra as últimas músicas tocadas.", inline=False)
+            embed.add_field(name=f"`{COMMAND_PREFIX}history [n]`, `{COMMAND_PREFIX}hist`", value="Mostra as últimas músicas tocadas.", inline=False)
+            embed.add_field(name=f"`{COMMAND_PREFIX}top [dias]`", value="Mostra as músicas mais tocadas no servidor (padrão: 7 dias).", inline=False)
+            embed.add_field(name=f"`{COMMAND_PREFIX}replay [n]`", value="Coloca de volta na fila as últimas n músicas tocadas.", inline=False)
             embed.add_field(name=f"`{COMMAND_PREFIX}join` / `{COMMAND_PREFIX}leave`", value="Conecta ou desconecta o bot do canal de voz.", inline=False)
-            embed.set_footer(text="Bot de música rápido e leve!")
-        await ctx.send(embed=embed, delete_after=60)
+            embed.set_footer(text="Todos os comandos também estão disponíveis como slash commands (/play, /skip...).")
+        if ctx.interaction is not None:
+            await ctx.send(embed=embed, ephemeral=True)
+        else:
+            await ctx.send(embed=embed, delete_after=60)
             
-    await setup(bot)
-    
     try:
-        await bot.start(TOKEN)
+        async with bot: # Inicializa o cliente (evento de ready, bot.loop) antes do setup dos cogs
+            await setup(bot)
+            await bot.start(TOKEN)
     except discord.errors.LoginFailure:
-        print("FALHA NO LOGIN: Token inválido. Verifique o TOKEN.")
+        log.critical("FALHA NO LOGIN: Token inválido. Verifique o TOKEN.")
     except Exception as e:
-        print(f"Erro crítico ao iniciar o bot: {e}")
+        log.critical("Erro crítico ao iniciar o bot: %s", e)
         if "PrivilegedIntentsRequired" in str(e):
-            print("ERRO: Intents privilegiadas (Message Content e/ou Voice States) podem não estar habilitadas no portal de desenvolvedores do Discord para este bot.")
+            log.critical("Intents privilegiadas (Message Content e/ou Voice States) podem não estar habilitadas no portal de desenvolvedores do Discord para este bot.")
+    finally:
+        log_listener.stop()  # Esvazia a fila antes de sair
+
+_mark_startup('module_loaded')
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Bot de música para Discord.")
+    parser.add_argument("--benchmark-startup", action="store_true",
+                        help="Mede o tempo até o bot ficar pronto (gateway + yt-dlp), imprime e sai.")
+    parser.add_argument("--benchmark-effects", type=int, nargs="?", const=300, metavar="SESSOES",
+                        help="Mede o custo por frame dos efeitos de áudio com N sessões simultâneas (padrão: 300) e sai.")
+    args = parser.parse_args()
+    if args.benchmark_effects:
+        benchmark_effects(args.benchmark_effects)
+        raise SystemExit(0)
     try: 
-        asyncio.run(main())
+        asyncio.run(main(benchmark_startup=args.benchmark_startup))
     except KeyboardInterrupt: 
         print("\nBot desligado.")
     except Exception as e_main:
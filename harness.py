@@ -0,0 +1,739 @@
+# harness.py
+# Harness offline para o MusicCog: gateway, servidores, canais e voice clients falsos,
+# mais um extrator stub no lugar do yt-dlp (latência e falhas configuráveis).
+# Permite rodar cenários determinísticos de carga/corrida sem Discord nem YouTube:
+#
+#   python harness.py --guilds 100 --skips 5
+#   python harness.py --scenario age-restricted --guilds 20
+#   python harness.py --scenario stream-drop --guilds 50
+#   python harness.py --scenario flood --guilds 50
+#   python harness.py --scenario error-storm --guilds 200
+#   python harness.py --scenario fast-fail --guilds 50
+#   python harness.py --scenario seek-race --guilds 50
+#   python harness.py --scenario ffmpeg-source
+#   python harness.py --scenario command-error
+import argparse
+import asyncio
+import collections
+import io
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from discord.ext import commands
+
+import bot as music_bot
+
+# --- Extrator Stub ---
+class StubExtractor:
+    # Substitui MusicCog._blocking_extract_info. Roda no executor, como o original.
+    def __init__(self, latency=0.05, jitter=0.0, failure_rate=0.0, age_restricted=(), playlist_size=10,
+                 track_duration=180, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.age_restricted = set(age_restricted)
+        self.playlist_size = playlist_size
+        self.track_duration = track_duration
+        self.calls = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _slug(self, query):
+        return query.rsplit("/", 1)[-1].replace(" ", "-").lower()
+
+    def _track(self, slug, source="yt"):
+        webpage_url = f"https://{source}.stub/{slug}"
+        return {
+            'webpage_url': webpage_url, 'title': f"Faixa {slug}", 'duration': self.track_duration,
+            'url': f"https://stream.stub/{source}/{slug}?expire={int(time.time()) + 6 * 3600}",
+            'ext': 'webm' if source == "yt" else 'mp3', 'acodec': 'opus' if source == "yt" else 'mp3',
+            'protocol': 'https' if source == "yt" else 'm3u8_native',
+        }
+
+    def __call__(self, query_or_url, is_soundcloud_search=False, process_for_stream_url=False,
+                 process_playlist=False, playlist_items_to_extract=None):
+        with self._lock:
+            kind = "soundcloud" if is_soundcloud_search else "stream" if process_for_stream_url else \
+                   "playlist" if process_playlist else "metadata"
+            self.calls[kind] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self._random.random() < self.failure_rate
+        time.sleep(delay)
+
+        slug = self._slug(query_or_url)
+        if is_soundcloud_search:
+            return {'entries': [self._track(slug, source="sc")]}
+        if slug in self.age_restricted or query_or_url in self.age_restricted:
+            raise music_bot.AgeRestrictionError(query_or_url, Exception("Sign in to confirm your age"))
+        if fail:
+            raise Exception(f"Falha simulada de extração para '{query_or_url}'")
+        if process_playlist and "list=" in query_or_url:
+            return {'_type': 'playlist', 'title': f"Playlist {slug}",
+                    'entries': [self._track(f"{slug}-{i}") for i in range(self.playlist_size)]}
+        info = self._track(slug)
+        if not process_for_stream_url:
+            info.pop('url')
+        return info
+
+# --- Fontes de Áudio e Voz Falsas ---
+class FakeAudioSource:
+    # Mesmo contrato que o MusicCog espera do MonitoredFFmpegPCMAudio (position, cleanup, on_cleanup...).
+    FRAME_SECONDS = 0.02
+
+    def __init__(self, stream_url, start_offset=0.0, drop_at=None):
+        self.stream_url = stream_url
+        self.start_offset = start_offset
+        self.drop_at = drop_at # Posição (s) em que o "stream" cai, simulando falha de rede
+        self.frames_read = 0
+        self.profile = "stub"
+        self.on_cleanup = None
+        self.deliberate = False
+        self.cleaned_up = False
+        self.pid = None
+
+    @property
+    def position(self):
+        return self.start_offset + self.frames_read * self.FRAME_SECONDS
+
+    def is_running(self):
+        return not self.cleaned_up
+
+    def discard(self):
+        self.deliberate = True
+        self.cleanup()
+
+    def cleanup(self):
+        self.cleaned_up = True
+        if self.on_cleanup:
+            callback, self.on_cleanup = self.on_cleanup, None
+            callback(self)
+
+class FakeVoiceClient:
+    # Simula o AudioPlayer: avança o relógio do source em tempo acelerado e chama `after` no fim.
+    def __init__(self, harness, guild, channel):
+        self.harness = harness
+        self.guild = guild
+        self.channel = channel
+        self._connected = True
+        self._paused = False
+        self._source = None
+        self._after = None
+        self._task = None
+        self.play_calls = 0
+        self.resumed_positions = [] # start_offset de cada source iniciado fora do começo (seek/retomada)
+        self.played_urls = []
+
+    def is_connected(self): return self._connected
+    def is_playing(self): return self._task is not None and not self._paused
+    def is_paused(self): return self._task is not None and self._paused
+
+    @property
+    def source(self):
+        return self._source if self._task is not None else None
+
+    @source.setter
+    def source(self, value):
+        if self._task is None:
+            raise ValueError('Not playing anything.')
+        self._source = value
+        self._paused = False # Como no discord.py: trocar o source retoma o player
+        self._record_resume(value)
+
+    def _record_resume(self, source):
+        if getattr(source, 'start_offset', 0) > 0:
+            self.resumed_positions.append(source.start_offset)
+
+    def play(self, source, *, after=None):
+        if self._task is not None:
+            raise RuntimeError("Already playing audio.")
+        if not self._connected:
+            raise RuntimeError("Not connected to voice.")
+        self.play_calls += 1
+        self.played_urls.append(getattr(source, 'stream_url', None))
+        self.harness.record_play_start(self.guild.id)
+        self._source, self._after, self._paused = source, after, False
+        self._record_resume(source)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        step = 50 # frames (1 s de áudio) por iteração
+        duration = self.harness.track_duration
+        try:
+            while True:
+                await asyncio.sleep(step * FakeAudioSource.FRAME_SECONDS / self.harness.time_scale)
+                if self._paused: continue
+                source = self._source
+                source.frames_read += step
+                drop_at = getattr(source, 'drop_at', None)
+                if source.position >= duration or (drop_at is not None and source.position >= drop_at):
+                    break
+        except asyncio.CancelledError:
+            return
+        self._finish()
+
+    def _finish(self, error=None):
+        source, after = self._source, self._after
+        self._task = self._after = None
+        if source: source.cleanup()
+        if after: after(error)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._finish()
+
+    def pause(self): self._paused = True
+    def resume(self): self._paused = False
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, force=False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+
+# --- Objetos do Discord Falsos ---
+class FakeMessage:
+    _ids = 0
+
+    def __init__(self, channel, content=None, embed=None, view=None):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.channel, self.content, self.embed, self.view = channel, content, embed, view
+        self.deleted = False
+
+    async def edit(self, content=None, embed=None, view=None):
+        self.channel.harness.api_calls['edit'] += 1
+        self.embed, self.view = embed or self.embed, view or self.view
+
+    async def delete(self):
+        self.channel.harness.api_calls['delete'] += 1
+        self.deleted = True
+
+class FakeTextChannel:
+    def __init__(self, harness, guild):
+        self.harness = harness
+        self.guild = guild
+        self.id = guild.id * 10
+        self.messages = []
+
+    async def send(self, content=None, *, embed=None, view=None, delete_after=None, ephemeral=False):
+        self.harness.api_calls['send'] += 1
+        message = FakeMessage(self, content, embed, view)
+        self.messages.append(message)
+        return message
+
+    def typing(self, **kwargs):
+        return _NullAsyncContext()
+
+class _NullAsyncContext:
+    async def __aenter__(self): return None
+    async def __aexit__(self, *exc): return False
+
+class FakeVoiceChannel:
+    def __init__(self, harness, guild):
+        self.harness, self.guild = harness, guild
+        self.name = f"voz-{guild.id}"
+
+    async def connect(self, timeout=None, reconnect=True):
+        self.guild.voice_client = FakeVoiceClient(self.harness, self.guild, self)
+        return self.guild.voice_client
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+class FakeMember:
+    def __init__(self, member_id, voice_channel=None):
+        self.id = member_id
+        self.mention = f"<@{member_id}>"
+        self.name = f"user{member_id}"
+        self.voice = FakeVoiceState(voice_channel) if voice_channel else None
+
+class FakeGuild:
+    def __init__(self, harness, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(harness, self)
+        self.voice_channel = FakeVoiceChannel(harness, self)
+
+class FakeContext:
+    # Imita um commands.Context de comando por prefixo (interaction=None).
+    def __init__(self, guild, author):
+        self.guild, self.author = guild, author
+        self.channel = guild.text_channel
+        self.message = FakeMessage(self.channel)
+        self.interaction = None
+        self.command = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self, **kwargs):
+        return _NullAsyncContext()
+
+    async def defer(self, **kwargs):
+        return None
+
+class FakeBot:
+    def __init__(self, loop):
+        self._loop = loop
+        self._logged_in = False
+        self.user = FakeMember(1)
+        self.guilds = {}
+
+    @property
+    def loop(self):
+        # Como no discord.py: bot.loop só existe depois do login (o setup dos cogs roda antes).
+        if not self._logged_in:
+            raise AttributeError("loop attribute cannot be accessed in non-async contexts")
+        return self._loop
+
+    def login(self):
+        self._logged_in = True
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    async def wait_until_ready(self):
+        return None
+
+# --- Harness ---
+class MusicHarness:
+    def __init__(self, extractor, time_scale=60.0, track_duration=180, drop_at=None, global_rate=None):
+        self.extractor = extractor
+        self.time_scale = time_scale # Segundos simulados por segundo real
+        self.track_duration = track_duration
+        self.drop_at = drop_at
+        self.api_calls = collections.Counter()
+        self.start_latencies = []
+        self._pending_starts = {}
+        self.bot = FakeBot(asyncio.get_running_loop())
+        self.cog = music_bot.MusicCog(self.bot, extractor=extractor,
+                                      history_store=music_bot.PlayHistoryStore(":memory:"))
+        self.cog._create_audio_source = self._create_audio_source
+        if global_rate is not None:
+            # Cenários que não testam admissão não devem esperar pelo limite global.
+            self.cog.admission.global_bucket = music_bot.TokenBucket(global_rate, global_rate)
+
+    async def start(self):
+        # Mesma ordem do main(): cog_load antes do login.
+        await self.cog.cog_load()
+        self.bot.login()
+
+    def _create_audio_source(self, stream_url, stream_format=None, is_local_file=False, start_at=0.0, effects=None):
+        # A primeira execução de cada stream cai em drop_at; a retomada (start_at > 0) segue normal.
+        drop_at = self.drop_at if start_at == 0 else None
+        source = FakeAudioSource(stream_url, start_offset=start_at, drop_at=drop_at)
+        source.effects = effects # Não processa PCM; só guarda, como o MonitoredFFmpegPCMAudio
+        return source
+
+    def add_guild(self, guild_id):
+        guild = FakeGuild(self, guild_id)
+        self.bot.guilds[guild_id] = guild
+        return guild
+
+    def context(self, guild, user_id=None):
+        # Por padrão, um usuário diferente por servidor (os limites por usuário são globais).
+        return FakeContext(guild, FakeMember(user_id or guild.id * 10, guild.voice_channel))
+
+    def record_play_start(self, guild_id):
+        started = self._pending_starts.pop(guild_id, None)
+        if started is not None:
+            self.start_latencies.append(time.perf_counter() - started)
+
+    async def invoke(self, command, guild, user_id=None, **kwargs):
+        # O cog não é registrado num Bot real, então chama o callback do comando diretamente.
+        return await command.callback(self.cog, self.context(guild, user_id), **kwargs)
+
+    async def play(self, guild, query, user_id=None):
+        self._pending_starts.setdefault(guild.id, time.perf_counter())
+        await self.invoke(self.cog.play_command, guild, user_id, query=query)
+
+    async def skip(self, guild, user_id=None):
+        await self.invoke(self.cog.skip_command, guild, user_id)
+
+    async def stop(self, guild, user_id=None):
+        await self.invoke(self.cog.stop_command, guild, user_id)
+
+    async def disconnect(self, guild):
+        channel = guild.voice_channel
+        if guild.voice_client:
+            await guild.voice_client.disconnect()
+        await self.cog.on_voice_state_update(self.bot.user, FakeVoiceState(channel), FakeVoiceState(None))
+
+    async def settle(self, seconds=0.2):
+        await asyncio.sleep(seconds)
+
+    async def wait_until_playing(self, guilds, timeout=30.0):
+        # Espera cada servidor estar tocando (ou sem nada na fila e nada iniciando).
+        deadline = time.perf_counter() + timeout
+        try:
+            # Pedidos adiados pela admissão ainda não estão na fila do servidor.
+            await asyncio.wait_for(self.cog._pending_resolutions.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        while time.perf_counter() < deadline:
+            pending = [g for g in guilds
+                       if g.id in self.cog._starting_playback
+                       or not (g.voice_client and g.voice_client.is_playing()) and self.cog.get_queue(g.id)]
+            if not pending:
+                return True
+            await asyncio.sleep(0.02)
+        return False
+
+    def check_invariants(self):
+        problems = []
+        for guild in self.bot.guilds.values():
+            vc = guild.voice_client
+            live = [src for src in self.cog.ffmpeg_supervisor.sources_for_guild(guild.id) if not src.cleaned_up]
+            attached = vc.source if vc else None
+            stray = [src for src in live if src is not attached]
+            if stray:
+                problems.append(f"servidor {guild.id}: {len(stray)} source(s) vivo(s) fora do player")
+            if vc and vc.is_playing() and guild.id not in self.cog.current_song_info:
+                problems.append(f"servidor {guild.id}: tocando sem current_song_info")
+        return problems
+
+    def close(self):
+        self.cog.cog_unload()
+
+    def report(self, title, elapsed):
+        lat = sorted(self.start_latencies)
+        print(f"== {title} ==")
+        print(f"tempo total: {elapsed:.2f}s | servidores: {len(self.bot.guilds)}")
+        print(f"extrações: {dict(self.extractor.calls)} (total {sum(self.extractor.calls.values())})")
+        print(f"chamadas à API (simuladas): {dict(self.api_calls)}")
+        if lat:
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+            print(f"latência de início: mediana {statistics.median(lat) * 1000:.1f} ms | p95 {p95 * 1000:.1f} ms | n={len(lat)}")
+        print(f"FFmpeg: iniciados {self.cog.ffmpeg_supervisor.spawned_total} | ativos {len(self.cog.ffmpeg_supervisor)}")
+        problems = self.check_invariants()
+        print("invariantes: OK" if not problems else "invariantes violadas:\n  " + "\n  ".join(problems))
+        return not problems
+
+# --- Cenários ---
+async def scenario_skip_race(args):
+    extractor = StubExtractor(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                              playlist_size=args.playlist_size, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    guilds = [harness.add_guild(1000 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.play(g, f"https://www.youtube.com/watch?v=x&list=pl{g.id}") for g in guilds))
+    await harness.wait_until_playing(guilds)
+    for _ in range(args.skips):
+        # Todos os servidores pulam ao mesmo tempo, e cada um pula duas vezes seguidas.
+        now = time.perf_counter()
+        for g in guilds: harness._pending_starts[g.id] = now
+        await asyncio.gather(*(harness.skip(g) for g in guilds for _ in range(2)))
+        await harness.wait_until_playing(guilds)
+    playing = sum(1 for g in guilds if g.voice_client and g.voice_client.is_playing())
+    print(f"tocando após {args.skips} rodadas de skip: {playing}/{len(guilds)}")
+    ok = harness.report("skip-race", time.perf_counter() - started)
+    await asyncio.gather(*(harness.stop(g) for g in guilds))
+    await harness.settle()
+    leaked = len(harness.cog.ffmpeg_supervisor)
+    print(f"FFmpeg após stop: {leaked} ativo(s)")
+    harness.close()
+    return ok and leaked == 0
+
+async def scenario_age_restricted(args):
+    extractor = StubExtractor(latency=args.latency, age_restricted={f"musica-{i}" for i in range(0, args.guilds, 2)},
+                              seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    guilds = [harness.add_guild(2000 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.play(g, f"musica {i}") for i, g in enumerate(guilds)))
+    await harness.wait_until_playing(guilds)
+    fallbacks = sum(1 for g in guilds if g.voice_client
+                    and any("stream.stub/sc/" in (url or "") for url in g.voice_client.played_urls))
+    print(f"fallbacks para SoundCloud: {fallbacks}")
+    ok = harness.report("age-restricted", time.perf_counter() - started)
+    harness.close()
+    return ok and fallbacks == len(extractor.age_restricted)
+
+async def scenario_stream_drop(args):
+    extractor = StubExtractor(latency=args.latency, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, drop_at=60, global_rate=args.global_rate)
+    await harness.start()
+    guilds = [harness.add_guild(3000 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.play(g, f"queda {i}") for i, g in enumerate(guilds)))
+    await harness.wait_until_playing(guilds)
+    # Espera o stream cair em 60s (tempo simulado) e a retomada acontecer.
+    deadline = time.perf_counter() + 30
+    while True:
+        await asyncio.sleep(0.05)
+        resumed = sum(1 for g in guilds if any(p >= 60 for p in g.voice_client.resumed_positions))
+        if resumed == len(guilds) or time.perf_counter() > deadline:
+            break
+    print(f"retomadas na posição: {resumed}/{len(guilds)} | plays por servidor: "
+          f"{max(g.voice_client.play_calls for g in guilds)}")
+    ok = harness.report("stream-drop", time.perf_counter() - started)
+    for g in guilds[: len(guilds) // 2]:
+        await harness.disconnect(g)
+    await harness.settle()
+    print(f"FFmpeg após desconectar metade: {len(harness.cog.ffmpeg_supervisor)} ativo(s)")
+    harness.close()
+    # A retomada reaproveita a URL ainda válida: uma extração por servidor, não duas.
+    return ok and resumed == len(guilds) and sum(extractor.calls.values()) == len(guilds)
+
+async def scenario_flood(args):
+    # Um usuário manda dezenas de playlists num servidor enquanto os outros pedem uma música cada.
+    extractor = StubExtractor(latency=args.latency, jitter=args.jitter, playlist_size=args.playlist_size, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale)
+    await harness.start()
+    abusive = harness.add_guild(4000)
+    guilds = [harness.add_guild(4001 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+    flood = [harness.play(abusive, f"https://www.youtube.com/watch?v=x&list=spam{i}", user_id=666) for i in range(30)]
+    await asyncio.gather(*flood, *(harness.play(g, f"pedido {g.id}") for g in guilds))
+    all_started = await harness.wait_until_playing(guilds)
+    served = sum(1 for g in guilds if g.voice_client and g.voice_client.play_calls > 0)
+    print(f"servidores normais atendidos: {served}/{len(guilds)} | fila do abusivo: {len(harness.cog.get_queue(abusive.id))} | "
+          f"recusados: {dict(harness.cog.admission.rejected)}")
+    ok = harness.report("flood", time.perf_counter() - started)
+    harness.close()
+    return ok and all_started and served == len(guilds) and len(harness.cog.get_queue(abusive.id)) <= music_bot.PLAY_USER_BURST * args.playlist_size
+
+async def scenario_fast_fail(args):
+    # A primeira música de cada servidor cai no primeiro frame (sem duração, então não há retomada) enquanto
+    # a mensagem do player ainda está sendo enviada. O fim dela não pode se perder: a fila tem que andar.
+    extractor = StubExtractor(latency=args.latency, track_duration=None, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    create_source = harness._create_audio_source
+    def create_failing_source(stream_url, *a, **kw):
+        source = create_source(stream_url, *a, **kw)
+        if "ruim" in stream_url: source.drop_at = 0
+        return source
+    harness.cog._create_audio_source = create_failing_source
+    update_player = harness.cog._update_player_message
+    updating = collections.defaultdict(asyncio.Event)
+    async def slow_update_player(guild_id, *a, **kw):
+        updating[guild_id].set()
+        await asyncio.sleep(0.2) # REST lento
+        return await update_player(guild_id, *a, **kw)
+    harness.cog._update_player_message = slow_update_player
+    guilds = [harness.add_guild(6000 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+
+    async def play_pair(g):
+        first = asyncio.create_task(harness.play(g, f"ruim {g.id}"))
+        await updating[g.id].wait() # A segunda música entra na fila durante a inicialização da primeira
+        await harness.play(g, f"boa {g.id}")
+        await first
+    await asyncio.gather(*(play_pair(g) for g in guilds))
+    await harness.wait_until_playing(guilds)
+    served = sum(1 for g in guilds if any("/boa-" in (url or "") for url in g.voice_client.played_urls))
+    print(f"segunda música tocada: {served}/{len(guilds)}")
+    ok = harness.report("fast-fail", time.perf_counter() - started)
+    harness.close()
+    return ok and served == len(guilds)
+
+async def scenario_seek_race(args):
+    # Um seek/retomada (restart_current_at com extração nova) ainda esperando o yt-dlp quando chega um !stop
+    # (metade dos servidores) ou um !skip (a outra metade). Ao voltar, ele não pode tocar a música antiga.
+    extractor = StubExtractor(latency=args.latency, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    guilds = [harness.add_guild(7000 + i) for i in range(args.guilds)]
+    started = time.perf_counter()
+    async def queue_pair(g):
+        await harness.play(g, f"antiga {g.id}")
+        await harness.play(g, f"nova {g.id}")
+    await asyncio.gather(*(queue_pair(g) for g in guilds))
+    await harness.wait_until_playing(guilds)
+
+    async def race(g, command):
+        restart = asyncio.create_task(harness.cog.restart_current_at(g.id, 30, refresh_stream=True))
+        await asyncio.sleep(args.latency / 5) # O restart já está esperando a extração
+        await command(g)
+        return await restart
+    stopped, skipped = guilds[: len(guilds) // 2], guilds[len(guilds) // 2:]
+    # Os pedidos adiados podem resolver fora de ordem: vale a música que estava tocando, não o nome.
+    before = {g.id: g.voice_client.source.stream_url for g in skipped}
+    results = await asyncio.gather(*(race(g, harness.stop) for g in stopped), *(race(g, harness.skip) for g in skipped))
+    await harness.wait_until_playing(skipped)
+    await harness.settle()
+    restarted = sum(1 for r in results if r)
+    silent = sum(1 for g in stopped if not (g.voice_client and g.voice_client.is_playing()))
+    on_next = sum(1 for g in skipped if g.voice_client and g.voice_client.source is not None
+                  and g.voice_client.source.stream_url != before[g.id] and not g.voice_client.resumed_positions)
+    print(f"restarts aplicados: {restarted} | parados em silêncio: {silent}/{len(stopped)} | "
+          f"na música seguinte desde o início: {on_next}/{len(skipped)}")
+    ok = harness.report("seek-race", time.perf_counter() - started)
+    harness.close()
+    return ok and restarted == 0 and silent == len(stopped) and on_next == len(skipped)
+
+# "FFmpeg" de mentira para o ffmpeg-source: avisos de reconexão no stderr, PCM no stdout, e o stderr fechado
+# ~0,5 s antes do fim do stdout, como o FFmpeg de verdade no fim de uma música.
+_FAKE_FFMPEG = """
+import os, time
+os.write(2, b"[https @ 0x1] Will reconnect at 1048576 in 0 second(s), error=End of file.\\n" * 3)
+frame = bytes(3840)
+for _ in range(50): os.write(1, frame)
+os.close(2)
+time.sleep(0.5)
+for _ in range(50): os.write(1, frame)
+"""
+
+async def scenario_ffmpeg_source(args):
+    # Os outros cenários trocam o MonitoredFFmpegPCMAudio pelo FakeAudioSource; este roda o source de verdade
+    # contra um executável falso: reconexões contadas, nenhuma thread extra e nada de CPU gasto com o stderr fechado.
+    with tempfile.TemporaryDirectory() as tmp:
+        executable = os.path.join(tmp, "ffmpeg")
+        with open(executable, "w") as f:
+            f.write(f"#!{sys.executable}\n{_FAKE_FFMPEG}")
+        os.chmod(executable, 0o755)
+        stats = music_bot.FFmpegProfileStats()
+        threads_before = threading.active_count()
+        started = time.perf_counter()
+        source = music_bot.MonitoredFFmpegPCMAudio("https://stream.stub/yt/ffmpeg-source", profile='youtube_opus',
+                                                   variant='fast', stats=stats, executable=executable)
+        extra_threads = threading.active_count() - threads_before
+        def drain(): # Como a thread do AudioPlayer: lê até o FFmpeg terminar
+            while source.read():
+                pass
+        cpu_before = time.process_time()
+        await asyncio.to_thread(drain)
+        cpu = time.process_time() - cpu_before
+        await asyncio.sleep(0.05) # O EOF do stderr é tratado no loop
+        source.cleanup()
+        elapsed = time.perf_counter() - started
+    row = (stats.summary() or [{}])[0]
+    print("== ffmpeg-source ==")
+    print(f"tempo total: {elapsed:.2f}s | frames: {source.frames_read} | threads extras: {extra_threads} | "
+          f"CPU durante a leitura: {cpu:.2f}s")
+    print(f"estatística: {row}")
+    return (source.frames_read == 100 and extra_threads == 0 and cpu < 0.25
+            and row.get('plays') == 1 and row.get('failures') == 0 and row.get('reconnects') == 3)
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+async def scenario_command_error(args):
+    # cog_command_error com erros de vários tipos: cada um responde no canal, e só os inesperados vão para o log.
+    harness = MusicHarness(StubExtractor(latency=args.latency), time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    guild = harness.add_guild(8000)
+    handler = _RecordingHandler()
+    music_bot.log.addHandler(handler)
+    cog = harness.cog
+    errors = [
+        commands.CommandInvokeError(RuntimeError("falha inesperada")),
+        commands.HybridCommandError(commands.CommandInvokeError(KeyError("chave"))),
+        commands.MissingRequiredArgument(cog.seek_command.clean_params['tempo']),
+        commands.CommandOnCooldown(commands.Cooldown(1, 10), 4.2, commands.BucketType.user),
+        commands.NoPrivateMessage(),
+    ]
+    started = time.perf_counter()
+    try:
+        for error in errors:
+            ctx = harness.context(guild)
+            ctx.command = cog.seek_command
+            await cog.cog_command_error(ctx, error)
+    finally:
+        music_bot.log.removeHandler(handler)
+    replies = [m.content for m in guild.text_channel.messages]
+    logged = [r for r in handler.records if r.levelno >= logging.ERROR]
+    for reply in replies: print(f"resposta: {reply}")
+    print(f"erros logados: {len(logged)} | com traceback: {sum(1 for r in logged if r.exc_info)} | "
+          f"com command: {sum(1 for r in logged if getattr(r, 'command', None) == 'seek')}")
+    ok = harness.report("command-error", time.perf_counter() - started)
+    harness.close()
+    return (ok and len(replies) == len(errors) and len(logged) == 2
+            and all(r.exc_info and getattr(r, 'command', None) == 'seek' for r in logged))
+
+class _CountingStream(io.TextIOBase):
+    # Destino do StreamHandler no error-storm: conta as linhas em vez de escrevê-las.
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        return len(text)
+
+async def _measure_loop_lag(stop_event, samples, interval=0.005):
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - expected)
+
+async def scenario_error_storm(args):
+    # Incidente no YouTube: toda extração falha ao mesmo tempo. O log deve ser deduplicado/amostrado
+    # e o loop de eventos não pode travar escrevendo no stdout.
+    stream = _CountingStream()
+    listener = music_bot.setup_logging(stream)
+    sampling_filter = logging.getLogger().handlers[0].filters[0]
+    extractor = StubExtractor(latency=args.latency, failure_rate=1.0, seed=args.seed)
+    harness = MusicHarness(extractor, time_scale=args.time_scale, global_rate=args.global_rate)
+    await harness.start()
+    guilds = [harness.add_guild(5000 + i) for i in range(args.guilds)]
+    stop_event, lag = asyncio.Event(), []
+    lag_task = asyncio.create_task(_measure_loop_lag(stop_event, lag))
+    started = time.perf_counter()
+    for _ in range(3):
+        await asyncio.gather(*(harness.play(g, f"incidente {g.id}") for g in guilds))
+        await harness.wait_until_playing(guilds)
+    stop_event.set()
+    await lag_task
+    listener.stop()
+    logging.getLogger().handlers.clear()
+    errors = sum(extractor.calls.values())
+    print(f"erros de extração: {errors} | linhas de log: {stream.lines} | suprimidas: {sampling_filter.suppressed_total} | "
+          f"atraso máx. do loop: {max(lag) * 1000:.1f} ms")
+    ok = harness.report("error-storm", time.perf_counter() - started)
+    harness.close()
+    return ok and errors > 0 and 0 < stream.lines < errors / 2
+
+SCENARIOS = {
+    'command-error': scenario_command_error,
+    'error-storm': scenario_error_storm,
+    'fast-fail': scenario_fast_fail,
+    'ffmpeg-source': scenario_ffmpeg_source,
+    'seek-race': scenario_seek_race,
+    'flood': scenario_flood,
+    'skip-race': scenario_skip_race,
+    'age-restricted': scenario_age_restricted,
+    'stream-drop': scenario_stream_drop,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Harness offline do MusicCog (gateway e extrator falsos).")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--skips", type=int, default=5)
+    parser.add_argument("--playlist-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latência simulada de cada extração (s)")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--time-scale", type=float, default=60.0, help="Segundos de áudio simulados por segundo real")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--global-rate", type=float, default=1000.0,
+                        help="Limite global de extrações/s nos cenários que não testam admissão (flood usa o padrão do bot)")
+    args = parser.parse_args()
+
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = {name: asyncio.run(SCENARIOS[name](args)) for name in names}
+    failed = [name for name, ok in results.items() if not ok]
+    print("\nresultado:", "OK" if not failed else f"FALHOU ({', '.join(failed)})")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()